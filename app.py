@@ -1,25 +1,63 @@
 
 # app.py
+import importlib
 import streamlit as st
-import pandas as pd
-from io import BytesIO
 
 # --- Custom Module Imports ---
 from config import (
     DROPBOX_ROOT_PATH, DAR_PDFS_PATH, MCM_DATA_PATH,
-    LOG_SHEET_PATH, SMART_AUDIT_DATA_PATH, MCM_PERIODS_INFO_PATH,
-    OFFICE_ORDERS_PATH
+    SMART_AUDIT_DATA_PATH, MCM_PERIODS_INFO_PATH, OFFICE_ORDERS_PATH,
+    LOGIN_LOGS_PATH
 )
 from css_styles import load_custom_css
-from dropbox_utils import get_dropbox_client, create_folder, upload_file
+from dropbox_utils import (
+    get_dropbox_client, create_folders_batch, get_missing_paths,
+    upload_new_files_batch, get_empty_xlsx_bytes
+)
 from ui_login import login_page
-from ui_pco import pco_dashboard
-from ui_audit_group import audit_group_dashboard
-from ui_smart_audit_tracker import smart_audit_tracker_dashboard, audit_group_tracker_view
+
+# Dashboard (module, function) to render for each (app_mode, role) pair.
+# The dashboard modules pull in plotly, reportlab, etc., so they are only
+# imported once someone has logged in.
+DASHBOARD_DISPATCH = {
+    ("smart_audit_tracker", "PCO"): ("ui_smart_audit_tracker", "smart_audit_tracker_dashboard"),
+    ("smart_audit_tracker", "AuditGroup"): ("ui_smart_audit_tracker", "audit_group_tracker_view"),
+    ("e-mcm", "PCO"): ("ui_pco", "pco_dashboard"),
+    ("e-mcm", "AuditGroup"): ("ui_audit_group", "audit_group_dashboard"),
+}
+
+def get_dashboard(app_mode, role):
+    """Imports and returns the dashboard function for a mode/role, or None if there isn't one."""
+    target = DASHBOARD_DISPATCH.get((app_mode, role))
+    if target is None:
+        return None
+    module_name, function_name = target
+    return getattr(importlib.import_module(module_name), function_name)
 
 # Load custom CSS styles
 load_custom_css()
 
+@st.cache_resource(show_spinner="Initializing Dropbox structure...")
+def ensure_dropbox_structure(_dbx):
+    """
+    Creates the app folders and central Excel files in Dropbox.
+    Cached as a resource so it runs once per server process, not once per session.
+    Raises RuntimeError if a step fails, so the failure isn't cached and the
+    next rerun tries again.
+    """
+    # Create all necessary folders
+    if not create_folders_batch(_dbx, [DROPBOX_ROOT_PATH, DAR_PDFS_PATH, OFFICE_ORDERS_PATH, LOGIN_LOGS_PATH]):
+        raise RuntimeError("Could not create the Dropbox folders.")
+
+    # Initialize centralized Excel files if they don't exist
+    missing_paths = get_missing_paths(_dbx, [MCM_DATA_PATH, SMART_AUDIT_DATA_PATH, MCM_PERIODS_INFO_PATH])
+    if missing_paths:
+        # Every missing file gets the same empty workbook
+        file_content = get_empty_xlsx_bytes()
+        if not upload_new_files_batch(_dbx, {path: file_content for path in missing_paths}):
+            raise RuntimeError("Could not create the central Excel files in Dropbox.")
+    return True
+
 # --- Session State Initialization ---
 def initialize_session_state():
     """Initializes all required session state variables."""
@@ -28,67 +66,37 @@ def initialize_session_state():
         'username': "",
         'role': "",
         'audit_group_no': None,
-        'dbx': None,
-        'dropbox_initialized': False,
         'app_mode': "e-mcm"
     }
     for key, value in states.items():
-        if key not in st.session_state:
-            st.session_state[key] = value
+        st.session_state.setdefault(key, value)
 
 initialize_session_state()
 
 # --- Main Application Logic ---
 if not st.session_state.logged_in:
     login_page()
-else:
-    if not st.session_state.dbx:
-        with st.spinner("Connecting to Dropbox..."):
-            st.session_state.dbx = get_dropbox_client()
-            if st.session_state.dbx:
-                st.rerun()
+    st.stop()
 
-    if st.session_state.dbx:
-        if not st.session_state.dropbox_initialized:
-            with st.spinner("Initializing Dropbox structure..."):
-                dbx = st.session_state.dbx
-                # Create all necessary folders
-                for folder_path in [DROPBOX_ROOT_PATH, DAR_PDFS_PATH, OFFICE_ORDERS_PATH]:
-                    create_folder(dbx, folder_path)
-                
-                # Initialize centralized Excel files if they don't exist
-                for path in [MCM_DATA_PATH, LOG_SHEET_PATH, SMART_AUDIT_DATA_PATH, MCM_PERIODS_INFO_PATH]:
-                    try:
-                        dbx.files_get_metadata(path)
-                    except Exception:
-                        # This is the corrected part
-                        output = BytesIO()
-                        pd.DataFrame().to_excel(output, index=False, engine='xlsxwriter')
-                        file_content = output.getvalue()
-                        upload_file(dbx, file_content, path)
+dbx = get_dropbox_client()
+if not dbx:
+    # Don't keep a failed connection cached; the next rerun retries.
+    get_dropbox_client.clear()
+    st.warning("Could not connect to Dropbox. Please check configuration and network.")
+    if st.button("Logout"):
+        st.session_state.logged_in = False
+        st.rerun()
+    st.stop()
 
-                st.session_state.dropbox_initialized = True
-                st.rerun()
+try:
+    ensure_dropbox_structure(dbx)
+except RuntimeError as e:
+    st.warning(f"{e} It will be retried on the next page load.")
 
-        if st.session_state.dropbox_initialized:
-            dbx = st.session_state.dbx
-            if st.session_state.app_mode == "smart_audit_tracker":
-                if st.session_state.role == "PCO":
-                    smart_audit_tracker_dashboard(dbx)
-                elif st.session_state.role == "AuditGroup":
-                    audit_group_tracker_view(dbx)
-            else:
-                if st.session_state.role == "PCO":
-                    pco_dashboard(dbx)
-                elif st.session_state.role == "AuditGroup":
-                    audit_group_dashboard(dbx)
-                else:
-                    st.error("Unknown user role. Please login again.")
-                    st.session_state.logged_in = False
-                    st.rerun()
-
-    elif st.session_state.logged_in:
-        st.warning("Could not connect to Dropbox. Please check configuration and network.")
-        if st.button("Logout"):
-            st.session_state.logged_in = False
-            st.rerun()
+dashboard = get_dashboard(st.session_state.app_mode, st.session_state.role)
+if dashboard:
+    dashboard(dbx)
+else:
+    st.error("Unknown user role. Please login again.")
+    st.session_state.logged_in = False
+    st.rerun()
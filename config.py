@@ -1,4 +1,10 @@
 # # config.py
+import hashlib
+import hmac
+import os
+import re
+import sys
+from types import MappingProxyType, SimpleNamespace
 import streamlit as st
 
 # --- Dropbox Configuration ---
@@ -7,29 +13,84 @@ DROPBOX_APP_SECRET = st.secrets.get("dropbox_app_secret", "")
 #DROPBOX_API_TOKEN = st.secrets.get("dropbox_api_token", "")
 # NEW: Use the refresh token
 DROPBOX_REFRESH_TOKEN = st.secrets.get("dropbox_refresh_token", "")
+# --- LLM Configuration ---
+# Read once at import like the Dropbox secrets, not on every extraction call
+OPENROUTER_API_KEY = st.secrets.get("openrouter_api_key", "")
 # --- Centralized Folders and Files ---
-DROPBOX_ROOT_PATH = "/e-MCM_App"
-DAR_PDFS_PATH = f"{DROPBOX_ROOT_PATH}/DAR_PDFs"
-OFFICE_ORDERS_PATH = f"{DROPBOX_ROOT_PATH}/Office_Orders" # Path for allocation/reallocation orders
-MCM_DATA_PATH = f"{DROPBOX_ROOT_PATH}/mcm_dar_data.xlsx"
-LOG_SHEET_PATH = f"{DROPBOX_ROOT_PATH}/log_sheet.xlsx"
-LOG_FILE_PATH = f"{DROPBOX_ROOT_PATH}/log_sheet.xlsx"
-SMART_AUDIT_DATA_PATH = f"{DROPBOX_ROOT_PATH}/smart_audit_data.xlsx"
-MCM_PERIODS_INFO_PATH = f"{DROPBOX_ROOT_PATH}/mcm_periods_info.xlsx"
+# Single definition of every Dropbox path; the *_PATH names below are aliases.
+_ROOT = "/e-MCM_App"
+PATHS = SimpleNamespace(
+    root=sys.intern(_ROOT),
+    dar_pdfs=sys.intern(f"{_ROOT}/DAR_PDFs"),
+    office_orders=sys.intern(f"{_ROOT}/Office_Orders"), # Path for allocation/reallocation orders
+    mcm_data=sys.intern(f"{_ROOT}/mcm_dar_data.xlsx"),
+    log_sheet=sys.intern(f"{_ROOT}/log_sheet.xlsx"),
+    login_logs=sys.intern(f"{_ROOT}/Login_Logs"), # Daily append-only JSONL login logs
+    smart_audit_data=sys.intern(f"{_ROOT}/smart_audit_data.xlsx"),
+    mcm_periods_info=sys.intern(f"{_ROOT}/mcm_periods_info.xlsx"),
+)
+DROPBOX_ROOT_PATH = PATHS.root
+DAR_PDFS_PATH = PATHS.dar_pdfs
+OFFICE_ORDERS_PATH = PATHS.office_orders
+MCM_DATA_PATH = PATHS.mcm_data
+LOG_SHEET_PATH = LOG_FILE_PATH = PATHS.log_sheet
+LOGIN_LOGS_PATH = PATHS.login_logs
+SMART_AUDIT_DATA_PATH = PATHS.smart_audit_data
+MCM_PERIODS_INFO_PATH = PATHS.mcm_periods_info
 
 
 # --- User Credentials ---
-USER_CREDENTIALS = {
-    "planning_officer": "pco_password",
-    **{f"audit_group{i}": f"ag{i}_audit" for i in range(1, 31)}
-}
-USER_ROLES = {
-    "planning_officer": "PCO",
-    **{f"audit_group{i}": "AuditGroup" for i in range(1, 31)}
-}
-AUDIT_GROUP_NUMBERS = {
-    f"audit_group{i}": i for i in range(1, 31)
+PCO_USERNAME = "planning_officer"
+AUDIT_GROUP_USERNAME_PREFIX = "audit_group"
+AUDIT_GROUP_COUNT = 30
+
+def audit_group_number(username):
+    """Returns the group number encoded in an 'audit_groupN' username (1-30), otherwise None."""
+    if not username or not username.startswith(AUDIT_GROUP_USERNAME_PREFIX):
+        return None
+    try:
+        group_no = int(username[len(AUDIT_GROUP_USERNAME_PREFIX):])
+    except ValueError:
+        return None
+    return group_no if 1 <= group_no <= AUDIT_GROUP_COUNT else None
+
+def user_role(username):
+    """Returns 'PCO', 'AuditGroup' or None for a username, without a lookup table."""
+    if username == PCO_USERNAME:
+        return "PCO"
+    return "AuditGroup" if audit_group_number(username) else None
+
+def _hash_password(salt, password):
+    return hashlib.sha256(salt + password.encode('utf-8')).digest()
+
+_RAW_PASSWORDS = {
+    PCO_USERNAME: "pco_password",
+    **{f"{AUDIT_GROUP_USERNAME_PREFIX}{i}": f"ag{i}_audit" for i in range(1, AUDIT_GROUP_COUNT + 1)}
 }
+
+# username -> ((salt, sha256(salt + password)), role, audit_group_no); built once at import.
+USERS = {}
+for _username, _password in _RAW_PASSWORDS.items():
+    _salt = os.urandom(16)
+    USERS[_username] = ((_salt, _hash_password(_salt, _password)), user_role(_username), audit_group_number(_username))
+del _RAW_PASSWORDS, _username, _password, _salt
+
+def authenticate(username, password):
+    """
+    Checks a username/password pair with a single table lookup.
+    Returns (role, audit_group_no) on success, otherwise None.
+    """
+    record = USERS.get(username)
+    if record is None:
+        return None
+    (salt, digest), role, group_no = record
+    if hmac.compare_digest(digest, _hash_password(salt, password or "")):
+        return role, group_no
+    return None
+
+def verify_password(username, password):
+    """Checks a username/password pair against the hashed credential table in constant time."""
+    return authenticate(username, password) is not None
 # --- New Constants for DAR Data Enhancement ---
 
 TAXPAYER_CLASSIFICATION_OPTIONS = [
@@ -44,7 +105,7 @@ TAXPAYER_CLASSIFICATION_OPTIONS = [
     "Other service sectors"
 ]
 
-GST_RISK_PARAMETERS = {
+GST_RISK_PARAMETERS = MappingProxyType({
     "P01": "Sale turnover (GSTR-3B) is less than the purchase turnover",
     "P03": "High ratio of nil-rated/exempt supplies to total turnover",
     "P04": "High ratio of zero-rated supplies to total turnover",
@@ -79,17 +140,17 @@ GST_RISK_PARAMETERS = {
     "P25": "High amount of IGST Refund claimed (for Risky Exporters)",
     "P26": "High amount of LUT Export Refund claimed (for Risky Exporters)",
     "P27": "High amount of Refund claimed due to inverted duty structure (for Risky Exporters)"
-}
+})
 
-RISK_PARAMETER_GROUPS = {
-    "GROUP A - TURNOVER & SUPPLY PATTERN": ["P01", "P03", "P04", "P09", "P10", "P21", "P22", "P23", "P29", "P31", "P32"],
-    "GROUP B - INPUT TAX CREDIT & INWARD SUPPLY": ["P02", "P05", "P06", "P07", "P14", "P15", "P16", "P17", "P18", "P19"],
-    "GROUP C - TAX PAYMENT & PROCEDURAL COMPLIANCE": ["P08", "P11", "P12", "P30"],
-    "GROUP D - CROSS-DEPARTMENTAL & ENTITY-LEVEL": ["P13", "P20", "P24", "P28", "P33", "P34"],
-    "GROUP E - REFUND & RISKY EXPORTER": ["P25", "P26", "P27"]
-}
+RISK_PARAMETER_GROUPS = MappingProxyType({
+    "GROUP A - TURNOVER & SUPPLY PATTERN": ("P01", "P03", "P04", "P09", "P10", "P21", "P22", "P23", "P29", "P31", "P32"),
+    "GROUP B - INPUT TAX CREDIT & INWARD SUPPLY": ("P02", "P05", "P06", "P07", "P14", "P15", "P16", "P17", "P18", "P19"),
+    "GROUP C - TAX PAYMENT & PROCEDURAL COMPLIANCE": ("P08", "P11", "P12", "P30"),
+    "GROUP D - CROSS-DEPARTMENTAL & ENTITY-LEVEL": ("P13", "P20", "P24", "P28", "P33", "P34"),
+    "GROUP E - REFUND & RISKY EXPORTER": ("P25", "P26", "P27")
+})
 
-BATCH_SYSTEM_PROMPT = """
+BATCH_SYSTEM_PROMPT = sys.intern("""
 You are an expert GST audit classifier. Analyze the given audit observations and classify each one into exactly one of the following categories:
 ## CLASSIFICATION CODES:
 ### TAX PAYMENT DEFAULTS (TP)
@@ -181,7 +242,15 @@ Input observations:
 2. Non-payment of interest on Input Tax Credit availed on invoices where payment to suppliers was made after 180 days
 3. Non-payment of late fee due to late filing of GSTR-1 returns
 Expected Output: TP01,IN03,RF01
-"""
+""")
+
+# Codes defined in BATCH_SYSTEM_PROMPT (prefix, number of codes), precomputed for response parsing
+VALID_CLASSIFICATION_CODES = frozenset(
+    {f"{prefix}{i:02d}" for prefix, count in [("TP", 8), ("RC", 7), ("IT", 11), ("IN", 7), ("RF", 7),
+                                              ("PD", 5), ("CV", 4), ("SS", 5), ("PG", 4)]
+     for i in range(1, count + 1)} | {"UNCLASSIFIED"}
+)
+CLASSIFICATION_CODE_RE = re.compile(r"\b(?:(?:TP|RC|IT|IN|RF|PD|CV|SS|PG)\d{2}|UNCLASSIFIED)\b")
 # # # config.py
 # import streamlit as st
 
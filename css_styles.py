@@ -1,8 +1,8 @@
 # css_styles.py
 import streamlit as st
 
-def load_custom_css():
-    st.markdown("""
+# Built once at import; load_custom_css() only re-emits it on each rerun.
+CUSTOM_CSS = """
     <style>
         /* --- Global Styles --- */
         body {
@@ -223,4 +223,7 @@ def load_custom_css():
         .stAlert[data-baseweb="notification"][kind="error"] { border-left-color: #e74c3c; }
 
     </style>
-    """, unsafe_allow_html=True)
\ No newline at end of file
+    """
+
+def load_custom_css():
+    st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
@@ -1,57 +1,410 @@
 # dar_processor.py
-import pdfplumber
-import google.generativeai as genai
+import hashlib
 import json
+import math
+import os
+import re
+import tempfile
+import pdfplumber
+import pypdfium2 as pdfium
+import threading
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import streamlit as st
 import time
-from typing import List, Dict, Any, Tuple
-from models import ParsedDARReport, DARHeaderSchema, AuditParaSchema
-from config import BATCH_SYSTEM_PROMPT, TAXPAYER_CLASSIFICATION_OPTIONS
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack, contextmanager
+from io import BytesIO
+from itertools import repeat
+from typing import Callable, List, Dict, Any, Optional, Sequence, Tuple
+from pydantic import ValidationError
+from models import ParsedDARReport, summarize_validation_error
+from config import (
+    BATCH_SYSTEM_PROMPT, OPENROUTER_API_KEY, TAXPAYER_CLASSIFICATION_OPTIONS,
+    VALID_CLASSIFICATION_CODES, CLASSIFICATION_CODE_RE
+)
+
+# Page extraction is pure-Python pdfminer work, so large PDFs are split into
+# page ranges and extracted in separate processes rather than threads.
+PDF_EXTRACT_MAX_WORKERS = min(4, os.cpu_count() or 1)
+PDF_PAGES_PER_WORKER = 8
+_PDFIUM_LOCK = threading.Lock()
+# Stop collecting DAR text past roughly what fits in the LLM context window;
+# oversized prompts only come back as request-too-large errors.
+MAX_DAR_TEXT_CHARS = 900_000
+IMAGE_ONLY_PAGE_NOTE = "[INFO: Page {page_no} is image-only; text extraction skipped]"
+# Pages with fewer characters than this (stamps, signatures, a caption on a scan)
+# skip layout padding; there is no structure on them worth preserving
+LAYOUT_MIN_PAGE_CHARS = 200
+# Stray "None" tokens left in extracted text (whole word only, so "Nonetheless"
+# survives), plus the padding spaces and blank lines that only cost prompt tokens
+_NONE_RE = re.compile(r"\bNone\b")
+_WHITESPACE_RUN_RE = re.compile(r"[ \t]{2,}")
+_TRAILING_SPACE_RE = re.compile(r"[ \t]+\n")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+# Running headers/footers are looked for among this many lines at each end of a page
+BOILERPLATE_EDGE_LINES = 2
+BOILERPLATE_MIN_PAGE_SHARE = 0.8
+BOILERPLATE_MIN_LINE_CHARS = 20
+_PAGE_NUMBER_LINE_RE = re.compile(r"^[\s-]*(?:page\s*\d+(?:\s*(?:of|/)\s*\d+)?|\d+\s*(?:of|/)\s*\d+)[\s-]*$", re.I)
+# DARs estimated above this many prompt tokens (~4 chars each) keep only their
+# opening pages and the pages that mention paras or amounts
+MAX_DAR_PROMPT_TOKENS = 30_000
+DAR_HEADER_PAGES = 3
+_RELEVANT_PAGE_RE = re.compile(
+    r"\bpara\b|para[-\s]*\d|gstin|trade\s+name|audit\s+group|revenue|recover|amount|\brs\.?\s*[\d,]", re.I
+)
+
+@contextmanager
+def _open_pdfplumber(pdf_source, pages: Optional[List[int]] = None):
+    """
+    Opens a path or raw bytes with pdfplumber. The PDF and any in-memory buffer
+    are closed on exit, even when extraction raises, so pdfminer's buffers are
+    released as soon as we're done with them.
+    """
+    with ExitStack() as stack:
+        if isinstance(pdf_source, bytes):
+            pdf_source = stack.enter_context(BytesIO(pdf_source))
+        yield stack.enter_context(pdfplumber.open(pdf_source, pages=pages))
 
-def preprocess_pdf_text(pdf_path_or_bytes) -> str:
+def _extract_page_texts(pdf_source, page_indices) -> List[Tuple[int, str]]:
     """
-    Extracts all text from all pages of the PDF using pdfplumber,
-    attempting to preserve layout for better LLM understanding.
+    Extracts layout text for the given 0-based page indices.
+    Opens its own copy of the PDF so it can run in a worker process.
+    """
+    page_texts = []
+    with _open_pdfplumber(pdf_source, pages=[i + 1 for i in page_indices]) as pdf:
+        for i, page in zip(page_indices, pdf.pages):
+            char_count = len(page.chars)
+            if not char_count:
+                # Scanned pages have no text layer; skip the layout analysis entirely
+                page_texts.append((i, IMAGE_ONLY_PAGE_NOTE.format(page_no=i + 1)))
+            else:
+                use_layout = char_count >= LAYOUT_MIN_PAGE_CHARS
+                page_texts.append((i, page.extract_text(x_tolerance=2, y_tolerance=2, layout=use_layout)))
+            # Drop pdfminer's per-page object caches before moving on
+            page.close()
+    return page_texts
+
+def _select_page_indices(page_count: int, pages: Optional[Sequence[int]]) -> List[int]:
+    """Turns optional 1-based page numbers into sorted 0-based indices, dropping any out of range."""
+    if pages is None:
+        return list(range(page_count))
+    return sorted({n - 1 for n in pages if 1 <= n <= page_count})
+
+def _count_pages(pdf_source) -> int:
+    """Returns the page count via pdfium, which reads the page tree without building pdfminer/pdfplumber objects."""
+    with _PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_source)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+@st.cache_resource
+def _get_pdf_process_pool() -> ProcessPoolExecutor:
+    """
+    Shared worker pool for layout extraction. Kept for the life of the server
+    so each large PDF doesn't pay for starting processes and importing pdfminer.
+    """
+    return ProcessPoolExecutor(max_workers=PDF_EXTRACT_MAX_WORKERS)
+
+def _extract_layout_text(pdf_source, pages: Optional[Sequence[int]] = None) -> List[Tuple[int, str]]:
+    """Extracts layout-preserving text with pdfplumber, fanning large PDFs out to worker processes."""
+    page_indices = _select_page_indices(_count_pages(pdf_source), pages)
+
+    page_ranges = [page_indices[start:start + PDF_PAGES_PER_WORKER]
+                   for start in range(0, len(page_indices), PDF_PAGES_PER_WORKER)]
+    if len(page_ranges) > 1 and PDF_EXTRACT_MAX_WORKERS > 1:
+        with ExitStack() as stack:
+            if isinstance(pdf_source, bytes):
+                # Spill the PDF to one temp file so each task pickles a short path, not the whole PDF
+                tmp = stack.enter_context(tempfile.NamedTemporaryFile(suffix=".pdf"))
+                tmp.write(pdf_source)
+                tmp.flush()
+                worker_source = tmp.name
+            else:
+                worker_source = pdf_source
+            try:
+                # map() yields in submission order, so pages stay in sequence
+                return [item for chunk in _get_pdf_process_pool().map(_extract_page_texts, repeat(worker_source), page_ranges)
+                        for item in chunk]
+            except BrokenProcessPool as e:
+                # A worker died (e.g. killed for memory); drop the pool so the next call starts a fresh one
+                print(f"PDF worker pool failed, extracting in-process: {e}")
+                _get_pdf_process_pool.clear()
+    return _extract_page_texts(pdf_source, page_indices)
+
+def _fast_extract(pdf_source, max_chars: int = MAX_DAR_TEXT_CHARS) -> List[Tuple[int, str]]:
+    """Extracts plain reading-order text page by page with pdfium, stopping once max_chars is reached."""
+    page_texts = []
+    total_chars = 0
+    # pdfium is not thread-safe and Streamlit runs each session in its own thread
+    with _PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_source)
+        try:
+            for i in range(len(pdf)):
+                page = pdf[i]
+                textpage = page.get_textpage()
+                if textpage.count_chars() == 0:
+                    page_text = IMAGE_ONLY_PAGE_NOTE.format(page_no=i + 1)
+                else:
+                    page_text = textpage.get_text_range().replace("\r\n", "\n")
+                textpage.close()
+                page.close()
+                page_texts.append((i, page_text))
+                total_chars += len(page_text)
+                if total_chars >= max_chars:
+                    break
+        finally:
+            pdf.close()
+    return page_texts
+
+def _clean_page_text(i: int, page_text: Optional[str]) -> str:
+    """Strips stray "None" tokens and layout padding from one page's text."""
+    if not page_text:
+        return f"[INFO: Page {i + 1} yielded no text directly]"
+    if "None" in page_text:
+        # Substring check first: most pages have no "None" and skip the regex pass
+        page_text = _NONE_RE.sub("", page_text)
+    page_text = _TRAILING_SPACE_RE.sub("\n", _WHITESPACE_RUN_RE.sub(" ", page_text))
+    # Keep single blank lines: they mark paragraph breaks between audit paras
+    return _BLANK_LINES_RE.sub("\n\n", page_text).strip()
+
+def _select_relevant_pages(page_texts: List[Tuple[int, str]]) -> Tuple[List[Tuple[int, str]], List[int]]:
+    """
+    Trims DARs whose text is estimated to exceed MAX_DAR_PROMPT_TOKENS down to the
+    header pages plus pages matching _RELEVANT_PAGE_RE and their immediate neighbours
+    (a para often continues onto the next page). Returns the kept pages and the
+    0-based indices of the pages left out.
+    """
+    if sum(len(text) for _, text in page_texts) // 4 <= MAX_DAR_PROMPT_TOKENS:
+        return page_texts, []
+    anchors = {position for position, (_, text) in enumerate(page_texts) if _RELEVANT_PAGE_RE.search(text)}
+    keep_positions = set(range(DAR_HEADER_PAGES))
+    for position in anchors:
+        keep_positions.update((position - 1, position, position + 1))
+    kept, dropped = [], []
+    for position, (i, text) in enumerate(page_texts):
+        if position in keep_positions:
+            kept.append((i, text))
+        else:
+            dropped.append(i)
+    return kept, dropped
+
+def _note_omitted_pages(page_texts: List[Tuple[int, str]], omitted: List[int]) -> List[Tuple[int, str]]:
+    """Appends a note to the last page listing the pages _select_relevant_pages left out."""
+    if not omitted:
+        return page_texts
+    note = f"[INFO: Pages {', '.join(str(i + 1) for i in omitted)} omitted to fit the model context; no para or amount details found on them]"
+    last_i, last_text = page_texts[-1]
+    return page_texts[:-1] + [(last_i, f"{last_text}\n{note}")]
+
+def _drop_running_boilerplate(page_texts: List[Tuple[int, str]]) -> List[Tuple[int, str]]:
+    """
+    Removes running headers and footers. Among the first and last few lines of
+    a page, "Page 3 of 20"-style page numbers are dropped (the page markers
+    already carry them), and long lines that recur verbatim on most pages are
+    kept only at their first occurrence. Short lines such as para statuses and
+    short pages, where the edges are the body, are left alone.
+    """
+    if len(page_texts) < 3:
+        return page_texts
+
+    def edge_line_indices(lines):
+        non_blank = [j for j, line in enumerate(lines) if line.strip()]
+        if len(non_blank) <= 2 * BOILERPLATE_EDGE_LINES:
+            return set()
+        return set(non_blank[:BOILERPLATE_EDGE_LINES] + non_blank[-BOILERPLATE_EDGE_LINES:])
+
+    split_pages = [(i, page_text.split("\n")) for i, page_text in page_texts]
+    line_page_counts = Counter()
+    for _, lines in split_pages:
+        line_page_counts.update({lines[j].strip() for j in edge_line_indices(lines)})
+    threshold = max(3, math.ceil(len(page_texts) * BOILERPLATE_MIN_PAGE_SHARE))
+    boilerplate = {line for line, count in line_page_counts.items()
+                   if count >= threshold and len(line) >= BOILERPLATE_MIN_LINE_CHARS}
+
+    seen = set()
+    result = []
+    for i, lines in split_pages:
+        edge = edge_line_indices(lines)
+        kept = []
+        for j, line in enumerate(lines):
+            if j in edge:
+                key = line.strip()
+                if _PAGE_NUMBER_LINE_RE.match(key):
+                    continue
+                if key in boilerplate:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+            kept.append(line)
+        result.append((i, "\n".join(kept).strip()))
+    return result
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _extract_pdf_text(pdf_bytes: bytes, use_layout: bool) -> str:
+    """
+    Builds the page-tagged text for a PDF. Cached on the PDF bytes, so reruns
+    and re-uploads of the same file skip parsing. Errors raise and aren't cached.
+    The pages to keep are chosen on pdfium's fast text; with use_layout, only
+    those pages then go through the slower pdfplumber layout extraction.
     """
     processed_text_parts = []
+    page_texts = _drop_running_boilerplate([(i, _clean_page_text(i, page_text))
+                                            for i, page_text in _fast_extract(pdf_bytes)])
+    page_texts, omitted = _select_relevant_pages(page_texts)
+    if use_layout:
+        layout_texts = _extract_layout_text(pdf_bytes, [i + 1 for i, _ in page_texts])
+        page_texts = _drop_running_boilerplate([(i, _clean_page_text(i, page_text)) for i, page_text in layout_texts])
+    page_texts = _note_omitted_pages(page_texts, omitted)
+
+    total_chars = 0
+    for i, page_text in page_texts:
+        if total_chars >= MAX_DAR_TEXT_CHARS:
+            processed_text_parts.append(f"\n[INFO: Text truncated before page {i + 1} to fit the model context]")
+            break
+        processed_text_parts.append(f"\n--- PAGE {i + 1} ---\n{page_text}")
+        total_chars += len(page_text)
+    return "".join(processed_text_parts)
+
+def preprocess_pdf_text(pdf_path_or_bytes, use_layout: bool = False) -> str:
+    """
+    Extracts the text of the PDF as "--- PAGE n ---" tagged plain text,
+    read in page order with pypdfium2. Pass use_layout=True to lay out the
+    kept pages with pdfplumber instead, which keeps table columns aligned.
+    """
     try:
-        with pdfplumber.open(pdf_path_or_bytes) as pdf:
-            for i, page in enumerate(pdf.pages):
-                page_text = page.extract_text(x_tolerance=2, y_tolerance=2, layout=True)
-                if page_text is None:
-                    page_text = f"[INFO: Page {i + 1} yielded no text directly]"
-                else:
-                    page_text = page_text.replace("None", "")
-                processed_text_parts.append(f"\n--- PAGE {i + 1} ---\n{page_text}")
-        full_text = "".join(processed_text_parts)
-        return full_text
+        # Normalise to raw bytes: they key the cache and can be sent to worker processes
+        if hasattr(pdf_path_or_bytes, "read"):
+            pdf_bytes = pdf_path_or_bytes.read()
+        elif isinstance(pdf_path_or_bytes, bytes):
+            pdf_bytes = pdf_path_or_bytes
+        else:
+            with open(pdf_path_or_bytes, "rb") as f:
+                pdf_bytes = f.read()
+        return _extract_pdf_text(pdf_bytes, use_layout)
     except Exception as e:
-        error_msg = f"Error processing PDF with pdfplumber: {type(e).__name__} - {e}"
+        backend = "pdfplumber" if use_layout else "pypdfium2"
+        error_msg = f"Error processing PDF with {backend}: {type(e).__name__} - {e}"
         print(error_msg)
         return error_msg
 
-def try_openrouter_model(model_name: str, prompt: str, openrouter_api_key: str, max_retries: int = 1) -> Tuple[str, str]:
+# 429s are left to the callers, which move on to the next model rather than
+# waiting out a free-tier rate limit on the same one.
+OPENROUTER_RETRY = Retry(
+    total=3, backoff_factor=1.5, backoff_jitter=1.0,
+    status_forcelist=(500, 502, 503, 504), allowed_methods=frozenset({"POST"}),
+    raise_on_status=False,
+)
+# The session is shared by every Streamlit session thread, all talking to one
+# host; keep more idle keep-alive connections than urllib3's default of 10 so
+# concurrent users don't have their connections discarded and re-handshaken
+OPENROUTER_POOL_MAXSIZE = 32
+
+@st.cache_resource
+def get_openrouter_session(openrouter_api_key: str) -> requests.Session:
+    """
+    Returns a process-wide requests session with the OpenRouter auth header set,
+    so repeat calls reuse pooled keep-alive connections instead of new TLS handshakes.
+    Transient connection errors and 5xx responses are retried with jittered backoff.
+    Shared across sessions; don't modify the returned object.
+    """
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=OPENROUTER_POOL_MAXSIZE,
+                                          max_retries=OPENROUTER_RETRY))
+    session.headers.update({
+        "Authorization": f"Bearer {openrouter_api_key}",
+        "Content-Type": "application/json",
+    })
+    return session
+
+STREAM_PROGRESS_INTERVAL_S = 0.5
+
+def _log_prompt_cache_usage(model_name: str, usage: Dict[str, Any]) -> None:
+    """Prints token usage, including how many prompt tokens the provider served from its prompt cache."""
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+    print(f"{model_name} usage: {usage.get('prompt_tokens', 0)} prompt tokens "
+          f"({cached} cached), {usage.get('completion_tokens', 0)} completion tokens")
+
+# Visible output allowed before the JSON starts; strip_json_fences drops the lead-in
+JSON_START_WINDOW = 200
+
+def _read_openrouter_stream(response: requests.Response, model_name: str,
+                            on_progress: Optional[Callable[[str], None]] = None) -> Tuple[str, Optional[str]]:
+    """
+    Collects the content deltas from an OpenRouter server-sent event stream.
+    Gives up once JSON_START_WINDOW characters of visible output contain no '{'
+    or '[', since that response would fail validation anyway; a short lead-in
+    such as "Here is the JSON:" or a code fence is allowed.
+    on_progress, if given, is called with the text received so far, at most
+    every STREAM_PROGRESS_INTERVAL_S seconds.
+    Returns (content, error_message) like try_openrouter_model.
+    """
+    parts = []
+    start_checked = False
+    last_progress = time.monotonic()
+    with response:
+        for line in response.iter_lines():
+            # Skip keep-alive blanks and ": OPENROUTER PROCESSING" comments
+            if not line.startswith(b"data: "):
+                continue
+            payload = line[6:]
+            if payload == b"[DONE]":
+                break
+            chunk = orjson.loads(payload)
+            if "error" in chunk:
+                return "", f"API Error from {model_name}: {chunk['error']}"
+            if chunk.get("usage"):
+                # The final chunk carries usage; cached_tokens shows whether the
+                # provider reused the stable system prompt prefix
+                _log_prompt_cache_usage(model_name, chunk["usage"])
+            choices = chunk.get("choices") or [{}]
+            parts.append(choices[0].get("delta", {}).get("content") or "")
+            if not start_checked:
+                head = "".join(parts).lstrip()[:JSON_START_WINDOW]
+                if "{" in head or "[" in head:
+                    start_checked = True
+                elif len(head) >= JSON_START_WINDOW:
+                    return "", f"{model_name} did not answer with JSON: {head[:100]}..."
+            if on_progress is not None and time.monotonic() - last_progress >= STREAM_PROGRESS_INTERVAL_S:
+                last_progress = time.monotonic()
+                on_progress("".join(parts))
+    return "".join(parts), None
+
+def try_openrouter_model(model_name: str, prompt: str, openrouter_api_key: str, max_retries: int = 1,
+                         follow_up: Optional[List[Dict[str, str]]] = None,
+                         on_progress: Optional[Callable[[str], None]] = None,
+                         system_prompt: Optional[str] = None) -> Tuple[str, str]:
     """
     Try a specific OpenRouter model with retries and exponential backoff.
+    system_prompt, if given, is sent as a system message ahead of the prompt.
+    follow_up messages, if given, are sent after the prompt as further conversation turns.
+    on_progress is passed through to _read_openrouter_stream.
     Returns (content, error_message). If successful, error_message is None.
     """
+    messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+    messages += [{"role": "user", "content": prompt}, *(follow_up or [])]
     for attempt in range(max_retries):
         try:
-            response = requests.post(
+            response = get_openrouter_session(openrouter_api_key).post(
                 url="https://openrouter.ai/api/v1/chat/completions",
-                headers={"Authorization": f"Bearer {openrouter_api_key}"},
-                data=json.dumps({
+                data=orjson.dumps({
                     "model": model_name,
-                    "messages": [{"role": "user", "content": prompt}]
+                    "messages": messages,
+                    "stream": True
                 }),
+                stream=True,
                 timeout=60  # Add timeout to prevent hanging
             )
 
             if response.status_code == 200:
-                response_data = response.json()
-                content_str = response_data.get('choices', [{}])[0].get('message', {}).get('content', '')
-                return content_str, None
+                return _read_openrouter_stream(response, model_name, on_progress)
             elif response.status_code == 429:
                 # Rate limit - wait and retry
                 wait_time = (2 ** attempt) * 5  # Exponential backoff: 5s, 10s
@@ -83,20 +436,11 @@ def try_openrouter_model(model_name: str, prompt: str, openrouter_api_key: str,
     
     return "", f"All retries failed for {model_name}"
 
-def get_structured_data_from_llm(text_content: str) -> ParsedDARReport:
-    """
-    Calls multiple LLM APIs with fallback strategy to handle rate limits.
-    Tries models in order: DeepSeek R1 -> Qwen3 Coder -> Gemini 2.0 Flash
-    """
-    if text_content.startswith("Error processing PDF"):
-        return ParsedDARReport(parsing_errors=text_content)
-
-    openrouter_api_key = st.secrets.get("openrouter_api_key", "")
-    if not openrouter_api_key:
-        error_msg = "OpenRouter API key not found in Streamlit secrets."
-        return ParsedDARReport(parsing_errors=error_msg)
-
-    prompt = f"""
+# The extraction prompt's fixed instructions, built once at import and sent as
+# the system message. Only the DAR text in the user message changes between
+# calls, so every request shares an identical prefix that provider-side prompt
+# caches can reuse.
+DAR_SYSTEM_PROMPT = f"""
     You are an expert GST audit report analyst. Based on the following text from a Departmental Audit Report (DAR),
     extract the specified information and structure it as a JSON object.
 
@@ -129,95 +473,475 @@ def get_structured_data_from_llm(text_content: str) -> ParsedDARReport:
     4.  **CRITICAL FOR REVENUE**: For `revenue_involved_rs` and `revenue_recovered_rs`, find the corresponding monetary amounts mentioned after the audit para headings in the text.Convert into the numeric value as a float. **For example, if the text says 'revenue involved is Rs. 5,50,000', the value must be `550000.0`**
     5.  If a value is not found, use null. All monetary values must be numbers (float).
     6.  The 'audit_paras' list should contain one object per para. If none found, provide an empty list [].
-    
+    """
+DAR_PROMPT_PREFIX = """
     DAR Text Content:
     --- START OF DAR TEXT ---
-    {text_content}
+    """
+DAR_PROMPT_SUFFIX = """
     --- END OF DAR TEXT ---
 
     Provide ONLY the JSON object as your response. Do not include any explanatory text.
     """
 
-    # Define models to try in order of preference
-    # models_to_try = [("qwen/qwen3-coder:free", "Qwen3 Coder"), 
-    #     ("deepseek/deepseek-r1:free", "DeepSeek R1"),
-        
-    #     ("google/gemini-2.0-flash-exp:free", "Gemini 2.0 Flash")
-    # ]
-    models_to_try =[("qwen/qwen3-coder:free", "Qwen3 Coder"),
-        ("deepseek/deepseek-r1:free", "DeepSeek R1"),
-        ("alibaba/tongyi-deepresearch-30b-a3b:free","Deep research"),
-        
-        ("google/gemini-2.0-flash-exp:free", "Gemini 2.0 Flash"),
-                    ("meituan/longcat-flash-chat:free","longcat"),
-    ]
-    content_str_for_return = ""
+# Opening brackets tried as the start of the JSON before falling back to a plain slice
+JSON_START_CANDIDATES = 8
+_JSON_DECODER = json.JSONDecoder()
+_JSON_START_RE = re.compile(r"[{\[]")
+
+def strip_json_fences(response_text: str) -> str:
+    """
+    Returns the JSON payload from an LLM response, dropping markdown fences and
+    any prose the model adds before or after it. The payload is the first
+    complete JSON value starting at a '{' or '[', ending at its own matching
+    bracket; brackets in the surrounding prose don't move either end.
+    If no complete value is found (e.g. the JSON is malformed), the span from
+    the first '{' or '[' to the last '}' or ']' is returned for validation to
+    report on.
+
+    >>> strip_json_fences('Here is the JSON [as requested]: {"a": [1]}')
+    '{"a": [1]}'
+    >>> strip_json_fences('```json\\n{"a": 1}\\n``` See note [1].')
+    '{"a": 1}'
+    """
+    for attempt, match in enumerate(_JSON_START_RE.finditer(response_text)):
+        if attempt == JSON_START_CANDIDATES:
+            break
+        try:
+            _, end = _JSON_DECODER.raw_decode(response_text, match.start())
+        except ValueError:
+            continue
+        return response_text[match.start():end]
+
+    starts = [i for i in (response_text.find("{"), response_text.find("[")) if i != -1]
+    end = max(response_text.rfind("}"), response_text.rfind("]"))
+    if not starts or end < min(starts):
+        return response_text.strip()
+    return response_text[min(starts):end + 1]
+
+class AllModelsFailedError(Exception):
+    """
+    Raised when every model in the fallback list fails to return a usable response.
+    attempts holds the (level, message) log of what was tried, for display.
+    """
+    def __init__(self, message: str, attempts: Optional[List[Tuple[str, str]]] = None):
+        super().__init__(message)
+        self.attempts = attempts or []
+
+# How many times a model is shown its own validation errors and asked to fix
+# its JSON before the next model in the fallback list is tried
+JSON_REPAIR_ATTEMPTS = 1
+JSON_REPAIR_PROMPT = "Your previous output failed validation with these errors: {errors}. Return the corrected JSON object only."
+
+def _repair_dar_json(model_id: str, prompt: str, bad_output: str, error: ValidationError,
+                     openrouter_api_key: str) -> Optional[ParsedDARReport]:
+    """
+    Sends a model's invalid output back with its validation errors and asks for
+    corrected JSON. Returns the validated report, or None if every attempt fails.
+    """
+    for attempt in range(JSON_REPAIR_ATTEMPTS):
+        time.sleep(1.0 * (attempt + 1))
+        follow_up = [
+            {"role": "assistant", "content": bad_output},
+            {"role": "user", "content": JSON_REPAIR_PROMPT.format(errors=summarize_validation_error(error))},
+        ]
+        content_str, request_error = try_openrouter_model(model_id, prompt, openrouter_api_key, follow_up=follow_up,
+                                                          system_prompt=DAR_SYSTEM_PROMPT)
+        if request_error is not None:
+            return None
+        bad_output = strip_json_fences(content_str)
+        try:
+            return ParsedDARReport.model_validate_json(bad_output)
+        except ValidationError as e:
+            error = e
+    return None
+
+# Below this many non-whitespace characters (page markers and [INFO] notes
+# excluded) a DAR is treated as scanned/empty and not sent to the LLM
+MIN_DAR_TEXT_CHARS = 500
+_MARKUP_RE = re.compile(r"--- PAGE \d+ ---|\[INFO: [^\]]*\]|\s+")
+IMAGE_ONLY_PDF_ERROR = "PDF appears to be image-only or has too little text; OCR required."
+
+def has_extractable_text(text_content: str, min_chars: int = MIN_DAR_TEXT_CHARS) -> bool:
+    """True if the preprocessed DAR text has at least min_chars of real content."""
+    return len(_MARKUP_RE.sub("", text_content)) >= min_chars
+
+def _show_extraction_progress(placeholder, model_name: str, partial_json: str) -> None:
+    """Shows how much of the report has streamed in, counting paras by their number key."""
+    header_note = "header received, " if '"audit_paras"' in partial_json else ""
+    paras_seen = partial_json.count('"audit_para_number"')
+    placeholder.caption(
+        f"📥 Receiving response from {model_name}: {header_note}{paras_seen} audit paras so far "
+        f"({len(partial_json):,} characters)"
+    )
+
+def _show_attempts(attempts: List[Tuple[str, str]]) -> None:
+    """Displays a (level, message) log from the LLM fallback loops, e.g. ("warning", "...") via st.warning."""
+    for level, message in attempts:
+        getattr(st, level)(message)
+
+def get_text_hash(text_content: str) -> str:
+    """Returns the SHA-256 hex digest of the DAR text, used as the LLM cache key."""
+    return hashlib.sha256(text_content.encode("utf-8")).hexdigest()
+
+# Models to try in order of preference
+# DAR_EXTRACTION_MODELS = [("qwen/qwen3-coder:free", "Qwen3 Coder"),
+#     ("deepseek/deepseek-r1:free", "DeepSeek R1"),
+
+#     ("google/gemini-2.0-flash-exp:free", "Gemini 2.0 Flash")
+# ]
+DAR_EXTRACTION_MODELS = [("qwen/qwen3-coder:free", "Qwen3 Coder"),
+    ("deepseek/deepseek-r1:free", "DeepSeek R1"),
+    ("alibaba/tongyi-deepresearch-30b-a3b:free", "Deep research"),
+    ("google/gemini-2.0-flash-exp:free", "Gemini 2.0 Flash"),
+    ("meituan/longcat-flash-chat:free", "longcat"),
+]
+
+# Free-tier rate limits last a while; a model that just answered 429 is moved to
+# the back of the fallback order for this long, so the next DAR (from any
+# session) starts with a model that is likely to answer instead of waiting on it
+MODEL_RATE_LIMIT_COOLDOWN_S = 60
+_rate_limited_until: Dict[str, float] = {}
+
+def _mark_rate_limited(model_id: str) -> None:
+    """Records that a model just answered 429."""
+    _rate_limited_until[model_id] = time.monotonic() + MODEL_RATE_LIMIT_COOLDOWN_S
+
+def _order_by_rate_limit(models: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """Keeps the configured order but moves models still cooling down from a 429 to the end."""
+    now = time.monotonic()
+    return sorted(models, key=lambda model: _rate_limited_until.get(model[0], 0.0) > now)
+
+# Reports are also remembered in-process by DAR text hash, for up to
+# DAR_REPORT_MEMO_TTL_S. This is a resource dict rather than st.cache_data so
+# the fallback loop can run outside any cached function: cache_data records
+# every message shown while it runs and replays them on each cache hit.
+DAR_REPORT_MEMO_TTL_S = 24 * 60 * 60
+DAR_REPORT_MEMO_MAX_ENTRIES = 200
+_DAR_REPORT_MEMO_LOCK = threading.Lock()
+
+@st.cache_resource
+def _get_dar_report_memo() -> "OrderedDict[str, Tuple[float, ParsedDARReport]]":
+    """Process-wide text hash -> (time stored, report) map, least recently used first."""
+    return OrderedDict()
+
+def _recall_dar_report(text_hash: str) -> Optional[ParsedDARReport]:
+    """Returns a copy of the remembered report for a DAR text, or None if there is no fresh one."""
+    memo = _get_dar_report_memo()
+    with _DAR_REPORT_MEMO_LOCK:
+        entry = memo.get(text_hash)
+        if entry is None:
+            return None
+        if time.time() - entry[0] > DAR_REPORT_MEMO_TTL_S:
+            del memo[text_hash]
+            return None
+        memo.move_to_end(text_hash)
+        # Copies, so a caller editing its report can't change what later sessions get
+        return entry[1].model_copy(deep=True)
+
+def _remember_dar_report(text_hash: str, report: ParsedDARReport) -> None:
+    """Stores a validated report, dropping the least recently used entries beyond the limit."""
+    memo = _get_dar_report_memo()
+    with _DAR_REPORT_MEMO_LOCK:
+        memo[text_hash] = (time.time(), report.model_copy(deep=True))
+        memo.move_to_end(text_hash)
+        while len(memo) > DAR_REPORT_MEMO_MAX_ENTRIES:
+            memo.popitem(last=False)
+
+def _extract_dar_report(prompt: str, openrouter_api_key: str,
+                        on_progress: Optional[Callable[[str, str], None]] = None
+                        ) -> Tuple[ParsedDARReport, List[Tuple[str, str]], str]:
+    """
+    Runs the model fallback loop and returns the first response that validates
+    as a ParsedDARReport. Shows nothing itself: returns (report, attempts,
+    raw_response), where attempts is a list of (level, message) pairs such as
+    ("warning", "...") for the caller to display. on_progress, if given, is
+    called with (model_name, text received so far) while a response streams in.
+    Raises AllModelsFailedError, carrying the attempts, if no model succeeds.
+    """
+    attempts: List[Tuple[str, str]] = []
     all_errors = []
-    n=1
-    for model_id, model_name in models_to_try:
-        
-        st.info(f"🤖 Trying AI Model {n}...")
-        n=n+1
-        
-        content_str, error = try_openrouter_model(model_id, prompt, openrouter_api_key)
-        
+    for n, (model_id, model_name) in enumerate(_order_by_rate_limit(DAR_EXTRACTION_MODELS), start=1):
+        attempts.append(("info", f"🤖 Trying AI Model {n}..."))
+        content_str, error = try_openrouter_model(
+            model_id, prompt, openrouter_api_key,
+            on_progress=(lambda partial, name=model_name: on_progress(name, partial)) if on_progress else None,
+            system_prompt=DAR_SYSTEM_PROMPT
+        )
+
         if error is None:
             # Success! Process the response
-            st.success(f"✅ Successfully got response from Model {n} ")
-            content_str_for_return = content_str
-            
+            attempts.append(("success", f"✅ Successfully got response from Model {n}"))
+            raw_response = content_str
+
             try:
                 # Clean up response
-                if content_str.strip().startswith("```json"):
-                    content_str = content_str.strip()[7:-3].strip()
-                elif content_str.strip().startswith("```"):
-                    content_str = content_str.strip()[3:-3].strip()
-                
+                content_str = strip_json_fences(content_str)
+
                 if not content_str:
                     all_errors.append(f"{model_name}: Empty response")
                     continue
-                
-                # Parse JSON
-                json_data = json.loads(content_str)
-                
-                # Show debug info
-                with st.expander(f"🔍 Raw {model_name} Response", expanded=False):
-                    st.text_area("Raw Response:", content_str_for_return, height=200, disabled=True)
-                
-                return ParsedDARReport(**json_data)
-                
-            except json.JSONDecodeError as e:
-                error_msg = f"Model {n} JSON decode error: {e}. Raw response: {content_str[:500]}..."
+
+                # Parse and validate in one pydantic-core pass, so a malformed
+                # response falls through to the next model
+                return ParsedDARReport.model_validate_json(content_str), attempts, raw_response
+
+            except ValidationError as e:
+                error_msg = f"Model {n} JSON validation error: {summarize_validation_error(e)}. Raw response: {content_str[:500]}..."
                 all_errors.append(error_msg)
-                st.warning(f"⚠️ {model_name} returned invalid JSON, trying next model...")
+                attempts.append(("warning", f"⚠️ {model_name} returned invalid JSON, asking it to correct the output..."))
+                repaired = _repair_dar_json(model_id, prompt, content_str, e, openrouter_api_key)
+                if repaired is not None:
+                    attempts.append(("success", f"✅ {model_name} returned corrected JSON"))
+                    return repaired, attempts, raw_response
+                attempts.append(("warning", f"⚠️ {model_name} could not correct its JSON, trying next model..."))
                 continue
             except Exception as e:
-                error_msg = f"Model {n}  processing error: {e}"
+                error_msg = f"Model {n} processing error: {e}"
                 all_errors.append(error_msg)
-                st.warning(f"⚠️ Error processing {model_name} response, trying next model...")
+                attempts.append(("warning", f"⚠️ Error processing {model_name} response, trying next model..."))
                 continue
         else:
             # Model failed
             all_errors.append(f"{model_name}: {error}")
             if "rate" in error.lower() and "limit" in error.lower():
-                st.warning(f"⚠️ Model {n}  is rate limited, trying next model...")
+                _mark_rate_limited(model_id)
+                attempts.append(("warning", f"⚠️ Model {n} is rate limited, trying next model..."))
             else:
-                st.warning(f"⚠️ Model {n}  failed: {error}")
-    
-    # All models failed
-    combined_errors = " | ".join(all_errors)
-    st.error(f"❌ All models failed. Errors: {combined_errors}")
-    return ParsedDARReport(parsing_errors=f"All models failed: {combined_errors}")
+                attempts.append(("warning", f"⚠️ Model {n} failed: {error}"))
+
+    raise AllModelsFailedError(" | ".join(all_errors), attempts)
+
+# Risk parameter codes P1..P34 (optionally zero-padded or hyphenated); a "(1)"
+# suffix as in "P1(1)" is left out of the match. Candidates found locally are
+# handed to the model so risk_flags becomes a selection rather than a search.
+_RISK_CODE_RE = re.compile(r"\bP-?0?([1-9]|[12][0-9]|3[0-4])\b")
+DAR_RISK_CODE_HINT = """
+    Hint: these risk parameter codes appear in the DAR text: {codes}. Use them for `risk_flags` where the DAR raises them.
+    """
+
+def find_risk_code_candidates(text_content: str) -> List[str]:
+    """Returns the distinct risk parameter codes in the text, zero-padded (e.g. 'P01'), in numeric order."""
+    return [f"P{n:02d}" for n in sorted({int(m) for m in _RISK_CODE_RE.findall(text_content)})]
+
+def get_structured_data_from_llm(text_content: str) -> ParsedDARReport:
+    """
+    Calls multiple LLM APIs with fallback strategy to handle rate limits.
+    Tries models in order: DeepSeek R1 -> Qwen3 Coder -> Gemini 2.0 Flash
+    """
+    if text_content.startswith("Error processing PDF"):
+        return ParsedDARReport.from_error(text_content)
+    if not has_extractable_text(text_content):
+        return ParsedDARReport.from_error(IMAGE_ONLY_PDF_ERROR)
+
+    openrouter_api_key = OPENROUTER_API_KEY
+    if not openrouter_api_key:
+        error_msg = "OpenRouter API key not found in Streamlit secrets."
+        return ParsedDARReport.from_error(error_msg)
+
+    text_hash = get_text_hash(text_content)
+    report = _recall_dar_report(text_hash)
+    if report is not None:
+        return report
+
+    risk_codes = find_risk_code_candidates(text_content)
+    # The hint goes before the suffix so the JSON-only instruction stays last
+    risk_code_hint = DAR_RISK_CODE_HINT.format(codes=", ".join(risk_codes)) if risk_codes else ""
+    prompt = DAR_PROMPT_PREFIX + text_content + risk_code_hint + DAR_PROMPT_SUFFIX
+
+    progress_placeholder = st.empty()
+    try:
+        report, attempts, raw_response = _extract_dar_report(
+            prompt, openrouter_api_key,
+            on_progress=lambda model_name, partial: _show_extraction_progress(progress_placeholder, model_name, partial)
+        )
+    except AllModelsFailedError as e:
+        progress_placeholder.empty()
+        _show_attempts(e.attempts)
+        st.error(f"❌ All models failed. Errors: {e}")
+        return ParsedDARReport.from_error(f"All models failed: {e}")
+    progress_placeholder.empty()
+    _show_attempts(attempts)
+    with st.expander("🔍 Raw AI Response", expanded=False):
+        st.code(raw_response, language="json")
+    _remember_dar_report(text_hash, report)
+    return report
+
+# On-disk cache of validated extraction results, keyed on the PDF bytes and
+# the prompt, so re-uploading a DAR skips both PDF parsing and the LLM and
+# survives app restarts. Bump DAR_CACHE_VERSION when the schema changes.
+DAR_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+DAR_CACHE_VERSION = "v2"
+# Entries older than this are re-extracted, so improvements in the fallback
+# models eventually reach DARs that were cached long ago
+DAR_CACHE_TTL_S = 30 * 24 * 60 * 60
+_DAR_PROMPT_DIGEST = hashlib.sha256(
+    (DAR_SYSTEM_PROMPT + DAR_PROMPT_PREFIX + DAR_PROMPT_SUFFIX).encode("utf-8")
+).hexdigest()
+
+def _dar_cache_path(pdf_bytes: bytes, use_layout: bool = False) -> str:
+    """Returns the cache file path for a PDF under the current prompt, cache version and extraction mode."""
+    # Feed the parts separately so the PDF bytes aren't copied into one concatenated buffer
+    key = hashlib.sha256(len(pdf_bytes).to_bytes(8, "little"))
+    key.update(pdf_bytes)
+    key.update(b"|" + _DAR_PROMPT_DIGEST.encode("ascii") + b"|" + DAR_CACHE_VERSION.encode("ascii"))
+    if use_layout:
+        key.update(b"|layout")
+    return os.path.join(DAR_CACHE_DIR, f"{key.hexdigest()}.json")
+
+def load_cached_dar_report(pdf_bytes: bytes, use_layout: bool = False) -> Optional[ParsedDARReport]:
+    """
+    Returns the cached ParsedDARReport for this PDF, or None on a miss.
+    Entries past DAR_CACHE_TTL_S or that no longer validate against the schema are deleted.
+    """
+    path = _dar_cache_path(pdf_bytes, use_layout)
+    try:
+        with open(path, "rb") as f:
+            if time.time() - os.fstat(f.fileno()).st_mtime <= DAR_CACHE_TTL_S:
+                return ParsedDARReport.model_validate_json(f.read())
+        print(f"Discarding expired DAR cache entry {path}")
+    except FileNotFoundError:
+        return None
+    except (OSError, ValidationError) as e:
+        print(f"Discarding DAR cache entry {path}: {e}")
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    return None
+
+def save_dar_report_to_cache(pdf_bytes: bytes, report: ParsedDARReport, use_layout: bool = False) -> None:
+    """Writes a successful extraction to the disk cache. Failures are logged, not raised."""
+    if report.parsing_errors:
+        return
+    path = _dar_cache_path(pdf_bytes, use_layout)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(DAR_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(report.model_dump_json().encode("utf-8"))
+        # Atomic rename, so concurrent sessions never read a half-written entry
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not write DAR cache entry {path}: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+# Para headings recur across DARs with only numbering/punctuation differences, so
+# classifications are remembered by normalised heading and persisted beside the
+# DAR cache; only unseen headings are sent to the LLM
+PARA_CLASSIFICATION_CACHE_PATH = os.path.join(DAR_CACHE_DIR, "para_classifications.json")
+_PARA_PREFIX_RE = re.compile(r"^\s*(?:audit\s+)?para(?:graph)?\s*[-.:]?\s*\d+\s*[-.:)]*\s*", re.I)
+_NON_WORD_RE = re.compile(r"[^a-z0-9]+")
+_PARA_CLASSIFICATION_LOCK = threading.Lock()
+
+def _normalize_heading(heading: str) -> str:
+    """Lower-cases a para heading and drops its 'Para-1:' prefix and punctuation."""
+    return _NON_WORD_RE.sub(" ", _PARA_PREFIX_RE.sub("", heading).lower()).strip()
+
+@st.cache_resource
+def _get_para_classification_cache() -> Dict[str, str]:
+    """Loads the persisted heading -> code map once per process."""
+    try:
+        with open(PARA_CLASSIFICATION_CACHE_PATH, "rb") as f:
+            return {k: v for k, v in orjson.loads(f.read()).items() if v in VALID_CLASSIFICATION_CODES}
+    except (OSError, orjson.JSONDecodeError, AttributeError):
+        return {}
+
+def _save_para_classification_cache(cache: Dict[str, str]) -> None:
+    """Atomically rewrites the persisted heading -> code map. Failures are logged, not raised."""
+    tmp_path = f"{PARA_CLASSIFICATION_CACHE_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(DAR_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(cache))
+        os.replace(tmp_path, PARA_CLASSIFICATION_CACHE_PATH)
+    except OSError as e:
+        print(f"Could not write para classification cache: {e}")
 
 def get_para_classifications_from_llm(audit_para_headings: List[str]) -> Tuple[List[str], str]:
     """
-    Calls multiple LLM APIs to classify audit para headings with fallback strategy.
+    Classifies audit para headings, reusing remembered codes for headings seen
+    before and calling the LLM only for the rest.
+    Returns a tuple: (list_of_codes, error_message_or_none).
+    """
+    cache = _get_para_classification_cache()
+    keys = [_normalize_heading(heading) for heading in audit_para_headings]
+    with _PARA_CLASSIFICATION_LOCK:
+        codes = [cache.get(key) for key in keys]
+    misses = [i for i, code in enumerate(codes) if code is None]
+    if not misses:
+        st.success("✅ All paras classified from previously seen headings")
+        return codes, None
+
+    # Headings that normalise to the same key are sent once; a heading with no
+    # usable key gets its own "#<index>" slot, which no normalised key can match
+    pending: Dict[str, List[int]] = {}
+    for i in misses:
+        pending.setdefault(keys[i] or f"#{i}", []).append(i)
+
+    new_codes, error = _classify_headings_with_llm([audit_para_headings[idx[0]] for idx in pending.values()])
+    if error:
+        return new_codes, error
+    with _PARA_CLASSIFICATION_LOCK:
+        for (key, indices), code in zip(pending.items(), new_codes):
+            for i in indices:
+                codes[i] = code
+            if code in VALID_CLASSIFICATION_CODES and not key.startswith("#"):
+                cache[key] = code
+        _save_para_classification_cache(dict(cache))
+    return codes, None
+
+# Large uploads are classified in chunks sent side by side: shorter answers come
+# back faster and are less likely to be truncated by the free models
+CLASSIFICATION_CHUNK_SIZE = 10
+CLASSIFICATION_MAX_WORKERS = 4
+
+def _classify_headings_with_llm(audit_para_headings: List[str]) -> Tuple[List[str], str]:
+    """
+    Classifies headings in chunks of CLASSIFICATION_CHUNK_SIZE, running up to
+    CLASSIFICATION_MAX_WORKERS chunks concurrently. Fails as a whole if any chunk fails.
+    The workers only make the API calls; their messages and raw responses are
+    shown here, on the script thread, once every chunk is back.
     Returns a tuple: (list_of_codes, error_message_or_none).
     """
-    openrouter_api_key = st.secrets.get("openrouter_api_key", "")
+    openrouter_api_key = OPENROUTER_API_KEY
     if not openrouter_api_key:
         return [], "OpenRouter API key not found."
 
+    chunks = [audit_para_headings[i:i + CLASSIFICATION_CHUNK_SIZE]
+              for i in range(0, len(audit_para_headings), CLASSIFICATION_CHUNK_SIZE)]
+    if len(chunks) <= 1:
+        results = [_classify_chunk_with_llm(audit_para_headings, openrouter_api_key)]
+    else:
+        with ThreadPoolExecutor(max_workers=min(CLASSIFICATION_MAX_WORKERS, len(chunks))) as executor:
+            results = list(executor.map(_classify_chunk_with_llm, chunks, repeat(openrouter_api_key)))
+
+    for _, _, _, attempts in results:
+        _show_attempts(attempts)
+    errors = [error for _, _, error, _ in results if error]
+    if errors:
+        combined_errors = " | ".join(errors)
+        st.error(f"❌ All classification models failed: {combined_errors}")
+        return [], f"All models failed: {combined_errors}"
+
+    # st.code rather than a text_area widget: identical responses would clash as duplicate widgets
+    with st.expander("🏷️ Classification Response", expanded=False):
+        for _, raw_content, _, _ in results:
+            st.code(raw_content, language=None)
+    return [code for codes, _, _, _ in results for code in codes], None
+
+def _classify_chunk_with_llm(audit_para_headings: List[str], openrouter_api_key: str
+                             ) -> Tuple[List[str], str, Optional[str], List[Tuple[str, str]]]:
+    """
+    Calls multiple LLM APIs to classify audit para headings with fallback strategy.
+    Shows nothing itself, so it can run on a worker thread.
+    Returns a tuple: (list_of_codes, raw_response, error_message_or_none, attempts),
+    where attempts is the (level, message) log for the caller to display.
+    """
+
     formatted_observations = "\n".join([f"{i+1}. {heading}" for i, heading in enumerate(audit_para_headings)])
     user_prompt = f"Here are the audit observations to classify:\n{formatted_observations}"
     
@@ -230,13 +954,13 @@ def get_para_classifications_from_llm(audit_para_headings: List[str]) -> Tuple[L
     ]
     
     all_errors = []
+    attempts: List[Tuple[str, str]] = []
     
-    for model_id, model_name in classification_models:
+    for model_id, model_name in _order_by_rate_limit(classification_models):
         try:
-            response = requests.post(
+            response = get_openrouter_session(openrouter_api_key).post(
                 url="https://openrouter.ai/api/v1/chat/completions",
-                headers={"Authorization": f"Bearer {openrouter_api_key}"},
-                data=json.dumps({
+                data=orjson.dumps({
                     "model": model_id,
                     "messages": [
                         {"role": "system", "content": BATCH_SYSTEM_PROMPT},
@@ -247,33 +971,32 @@ def get_para_classifications_from_llm(audit_para_headings: List[str]) -> Tuple[L
             )
 
             if response.status_code == 200:
-                response_data = response.json()
+                response_data = orjson.loads(response.content)
                 content_str = response_data.get('choices', [{}])[0].get('message', {}).get('content', '').strip()
 
                 if not content_str:
                     all_errors.append(f"{model_name}: Empty response")
                     continue
 
-                # Parse classifications
-                classifications = [code.strip() for code in content_str.split(',')]
+                # Parse classifications; codes outside the prompt's list become UNCLASSIFIED
+                classifications = [
+                    code if code in VALID_CLASSIFICATION_CODES else "UNCLASSIFIED"
+                    for code in CLASSIFICATION_CODE_RE.findall(content_str)
+                ]
 
                 if len(classifications) != len(audit_para_headings):
                     error_msg = f"{model_name}: Classification count mismatch. Expected {len(audit_para_headings)}, got {len(classifications)}."
                     all_errors.append(error_msg)
                     continue
 
-                st.success(f"✅ Classification successful with {model_name}")
-                
-                # Show debug info
-                with st.expander(f"🏷️ {model_name} Classification Response", expanded=False):
-                    st.text_area("Classification Response:", content_str, height=100, disabled=True)
-                
-                return classifications, None
+                attempts.append(("success", f"✅ Classification successful with {model_name}"))
+                return classifications, content_str, None, attempts
 
             elif response.status_code == 429:
-                error_msg = f"Model {n} : Rate limited"
+                error_msg = f"{model_name}: Rate limited"
                 all_errors.append(error_msg)
-                st.warning(f"⚠️ Model {n} is rate limited, trying next model...")
+                _mark_rate_limited(model_id)
+                attempts.append(("warning", f"⚠️ {model_name} is rate limited, trying next model..."))
                 continue
             else:
                 error_msg = f"{model_name}: API Error {response.status_code} - {response.text}"
@@ -294,9 +1017,7 @@ def get_para_classifications_from_llm(audit_para_headings: List[str]) -> Tuple[L
             continue
 
     # All models failed
-    combined_errors = " | ".join(all_errors)
-    st.error(f"❌ All classification models failed: {combined_errors}")
-    return [], f"All models failed: {combined_errors}"
+    return [], "", " | ".join(all_errors), attempts
     
 # # dar_processor.py
 # import pdfplumber
@@ -1,7 +1,11 @@
 # dropbox_utils.py
 import streamlit as st
 import dropbox
+import json
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dropbox.exceptions import AuthError, ApiError
 from io import BytesIO
@@ -9,40 +13,155 @@ import pandas as pd
 # Import the new config variable
 # Import config variables, including LOG_FILE_PATH
 from config import (
-    DROPBOX_APP_KEY, DROPBOX_APP_SECRET, DROPBOX_REFRESH_TOKEN, LOG_FILE_PATH
+    DROPBOX_APP_KEY, DROPBOX_APP_SECRET, DROPBOX_REFRESH_TOKEN, LOGIN_LOGS_PATH
 )
 
+def get_login_log_path(day):
+    """Returns the daily login log shard for a date, e.g. '.../Login_Logs/log_20250714.jsonl'."""
+    return f"{LOGIN_LOGS_PATH}/log_{day:%Y%m%d}.jsonl"
+
+# Attempts at appending to a log shard that another writer changed in between
+LOG_WRITE_ATTEMPTS = 3
+
 def log_activity(dbx, username, role):
     """
-    Appends a new login activity record to the log file in Dropbox.
-    This function reads the existing file, adds a row, and re-uploads it.
+    Appends a new login activity record to today's JSONL log in Dropbox.
+    Only the current day's small shard is rewritten, so a login no longer
+    downloads and re-uploads the whole login history as a workbook.
+    The upload is conditional on the revision that was read; if another login
+    wrote the shard in between, the append is redone on the new content.
+    Runs on a background thread, so problems are printed rather than shown
+    with st.* calls, which Streamlit drops outside the script thread.
     """
     if not dbx:
-        st.warning("Dropbox client is not available. Skipping activity logging.")
+        print("Dropbox client is not available. Skipping activity logging.")
         return False
 
-    log_columns = ['Timestamp', 'Username', 'Role']
-    
-    # Read existing log data from the path specified in config
-    df_logs = read_from_spreadsheet(dbx, LOG_FILE_PATH)
+    now = datetime.now()
+    record = {'Timestamp': now.strftime("%Y-%m-%d %H:%M:%S"), 'Username': username, 'Role': role}
+    log_line = (json.dumps(record) + "\n").encode('utf-8')
 
-    # If the file is empty or has wrong columns, create a new DataFrame in memory
-    if df_logs.empty or list(df_logs.columns) != log_columns:
-        df_logs = pd.DataFrame(columns=log_columns)
+    shard_path = get_login_log_path(now)
+    for _ in range(LOG_WRITE_ATTEMPTS):
+        # Only a missing shard starts empty; a failed download must not wipe the day's records
+        existing_content, rev = download_file_with_rev(dbx, shard_path, missing=(b"", None), on_error=print)
+        if existing_content is None:
+            return False
+        mode = dropbox.files.WriteMode.update(rev) if rev else dropbox.files.WriteMode.add
+        try:
+            dbx.files_upload(existing_content + log_line, shard_path, mode=mode)
+            return True
+        except ApiError as e:
+            if e.error.is_path() and e.error.get_path().reason.is_conflict():
+                continue # Another login wrote the shard first; re-read and append again
+            print(f"Failed to update the log file in Dropbox: {e}")
+            return False
+    print("Failed to update the log file in Dropbox: it kept changing during the update.")
+    return False
 
-    # Append the new log entry
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    new_log_entry = pd.DataFrame([{'Timestamp': timestamp, 'Username': username, 'Role': role}])
-    df_logs = pd.concat([df_logs, new_log_entry], ignore_index=True)
+def read_login_log_records(dbx, since=None):
+    """
+    Returns the login records stored in the daily JSONL logs.
+    If `since` (a date) is given, only shards from that day onwards are downloaded.
+    """
+    shard_names = sorted(
+        name for name in list_files(dbx, LOGIN_LOGS_PATH)
+        if name.startswith("log_") and name.endswith(".jsonl")
+    )
+    if since is not None:
+        first_shard = get_login_log_path(since).rsplit("/", 1)[-1]
+        shard_names = [name for name in shard_names if name >= first_shard]
+    if not shard_names:
+        return []
 
-    # Upload the updated DataFrame back to Dropbox
-    if update_spreadsheet_from_df(dbx, df_logs, LOG_FILE_PATH):
-        return True
-    else:
-        st.error("Failed to update the log file in Dropbox.")
-        return False
+    shard_paths = [f"{LOGIN_LOGS_PATH}/{name}" for name in shard_names]
+    with ThreadPoolExecutor(max_workers=min(8, len(shard_paths))) as executor:
+        contents = list(executor.map(lambda path: download_file(dbx, path), shard_paths))
+
+    records = []
+    for content in contents:
+        if not content:
+            continue
+        for line in content.decode('utf-8').splitlines():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue # Skip a partially written line
+    return records
+
+@st.cache_resource
+def get_background_executor():
+    """
+    Process-wide single worker for fire-and-forget Dropbox writes.
+    One worker keeps read-modify-write appends (like the log sheet) serialized.
+    """
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="dropbox-bg")
+
+@st.cache_resource
+def get_upload_executor():
+    """
+    Process-wide pool for DAR PDF uploads. Kept apart from the single log
+    worker so an upload never queues behind login-log retries.
+    """
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="dropbox-upload")
+
+def log_activity_async(dbx, username, role):
+    """Queues log_activity on the background executor so login doesn't wait on Dropbox."""
+    def _report_failure(future):
+        if future.exception() is not None:
+            print(f"Background login logging failed for {username}: {future.exception()}")
+        elif future.result() is False:
+            print(f"Background login logging failed for {username}")
+
+    future = get_background_executor().submit(log_activity, dbx, username, role)
+    future.add_done_callback(_report_failure)
+    return future
+# Client-side cap on Dropbox API calls across all sessions. Staying under it avoids
+# 429 too_many_requests responses and the SDK's long retry back-off that follows.
+DROPBOX_MAX_CALLS_PER_SECOND = 12
+
+class RateLimitedDropbox:
+    """
+    Wraps a dropbox.Dropbox client and paces its API method calls so that at
+    most `max_calls_per_second` start in any one-second window. Non-callable
+    attributes are passed straight through to the wrapped client.
+    """
+    def __init__(self, dbx, max_calls_per_second=DROPBOX_MAX_CALLS_PER_SECOND):
+        self._dbx = dbx
+        self._max_calls = max_calls_per_second
+        self._call_times = deque()
+        self._lock = threading.Lock()
+
+    def _wait_for_slot(self):
+        with self._lock:
+            now = time.monotonic()
+            while self._call_times and now - self._call_times[0] >= 1.0:
+                self._call_times.popleft()
+            if len(self._call_times) >= self._max_calls:
+                time.sleep(1.0 - (now - self._call_times.popleft()))
+            self._call_times.append(time.monotonic())
+
+    def __getattr__(self, name):
+        attr = getattr(self._dbx, name)
+        if not callable(attr):
+            return attr
+
+        def rate_limited(*args, **kwargs):
+            self._wait_for_slot()
+            return attr(*args, **kwargs)
+        return rate_limited
+
+# Last short-lived access token obtained from the refresh token. Reused when the
+# cached client is rebuilt so the SDK skips the OAuth refresh until it expires.
+_ACCESS_TOKEN_STATE = {"token": None, "expiration": None}
+
+@st.cache_resource(ttl=3600)
 def get_dropbox_client():
-    """Initializes and returns the Dropbox client using a refresh token."""
+    """
+    Initializes and returns the Dropbox client using a refresh token.
+    Cached as a process-wide resource so the client (and its token refresh)
+    is shared across reruns and sessions instead of being rebuilt per user.
+    """
     try:
         # Check if the secrets have been loaded into the config variables
         if not all([DROPBOX_APP_KEY, DROPBOX_APP_SECRET, DROPBOX_REFRESH_TOKEN]):
@@ -52,15 +171,22 @@ def get_dropbox_client():
         # Initialize the client with the app key, secret, and refresh token
         # The SDK will handle refreshing the access token automatically
         dbx = dropbox.Dropbox(
+            oauth2_access_token=_ACCESS_TOKEN_STATE["token"],
+            oauth2_access_token_expiration=_ACCESS_TOKEN_STATE["expiration"],
             app_key=DROPBOX_APP_KEY,
             app_secret=DROPBOX_APP_SECRET,
             oauth2_refresh_token=DROPBOX_REFRESH_TOKEN
         )
         # Test the connection by getting the current user's account info
         dbx.users_get_current_account()
-        return dbx
+        # Remember the (possibly refreshed) token for the next client rebuild
+        _ACCESS_TOKEN_STATE["token"] = dbx._oauth2_access_token
+        _ACCESS_TOKEN_STATE["expiration"] = dbx._oauth2_access_token_expiration
+        return RateLimitedDropbox(dbx)
         
     except AuthError as e:
+        _ACCESS_TOKEN_STATE["token"] = None
+        _ACCESS_TOKEN_STATE["expiration"] = None
         st.error(f"Authentication Error: Please check your Dropbox credentials. Details: {e}")
         return None
     except Exception as e:
@@ -88,15 +214,34 @@ def get_shareable_link(dbx, dropbox_path):
         print(f"Dropbox API error getting shareable link for {dropbox_path}: {e}")
         return None # Return None if a link can't be fetched or created
         
-def upload_pdf_file(dbx, file_content, dropbox_path):
-    """Uploads a file to a specific path in Dropbox."""
+def _upload_file_overwrite(dbx, file_content, dropbox_path):
+    """
+    Uploads a file, replacing any existing one. Returns None on success or the
+    error message; it shows nothing itself, so it can run off the script thread.
+    """
     try:
         dbx.files_upload(file_content, dropbox_path, mode=dropbox.files.WriteMode('overwrite'))
-        st.write("Uploading the sheet to db")
-        return True
-    except ApiError as e:
-        st.error(f"Dropbox API error during upload: {e}")
+        return None
+    except Exception as e:
+        return f"Dropbox API error during upload: {e}"
+
+def upload_pdf_file(dbx, file_content, dropbox_path):
+    """Uploads a file to a specific path in Dropbox."""
+    error = _upload_file_overwrite(dbx, file_content, dropbox_path)
+    if error:
+        st.error(error)
         return False
+    st.write("Uploading the sheet to db")
+    return True
+
+def upload_pdf_file_async(dbx, file_content, dropbox_path):
+    """
+    Queues the upload on the shared upload executor and returns its Future,
+    so the caller can make other network calls while the upload runs. The Future
+    resolves to None on success or the error message, for the caller to display.
+    """
+    return get_upload_executor().submit(_upload_file_overwrite, dbx, file_content, dropbox_path)
+
 def upload_file(dbx, file_content, dropbox_path):
     """Try different methods to keep same filename"""
     import time
@@ -158,22 +303,62 @@ def upload_file(dbx, file_content, dropbox_path):
         return False
 def download_file(dbx, dropbox_path):
     """Downloads a file from a specific path in Dropbox."""
+    content, _ = download_file_with_rev(dbx, dropbox_path)
+    return content
+
+def download_file_with_rev(dbx, dropbox_path, missing=(None, None), on_error=st.error):
+    """
+    Downloads a file and returns (content, rev); (None, None) if the download fails.
+    A file that doesn't exist returns `missing`, so callers can tell it apart from a failure.
+    Errors are reported through `on_error`; pass print when calling off the script thread.
+    """
     try:
-        _, res = dbx.files_download(path=dropbox_path)
-        return res.content
+        metadata, res = dbx.files_download(path=dropbox_path)
+        return res.content, metadata.rev
     except ApiError as e:
         if isinstance(e.error, dropbox.files.DownloadError) and e.error.is_path() and e.error.get_path().is_not_found():
-            return None
-        st.error(f"Dropbox API error during download: {e}")
+            return missing
+        on_error(f"Dropbox API error during download: {e}")
+        return None, None
+
+def get_file_rev(dbx, dropbox_path):
+    """Returns the current revision id of a Dropbox file, or None if it can't be looked up."""
+    try:
+        return getattr(dbx.files_get_metadata(dropbox_path), 'rev', None)
+    except ApiError:
         return None
 
+_EMPTY_XLSX = None
+
+def get_empty_xlsx_bytes():
+    """Returns the bytes of an empty Excel workbook, built only once per process."""
+    global _EMPTY_XLSX
+    if _EMPTY_XLSX is None:
+        output = BytesIO()
+        pd.DataFrame().to_excel(output, index=False, engine='xlsxwriter')
+        _EMPTY_XLSX = output.getvalue()
+    return _EMPTY_XLSX
+
+# dropbox_path -> (rev, DataFrame) of the last parsed download, shared by all sessions.
+_SPREADSHEET_CACHE = {}
+
 def read_from_spreadsheet(dbx, dropbox_path):
-    """Reads an Excel file in Dropbox into a pandas DataFrame."""
-    file_content = download_file(dbx, dropbox_path)
+    """
+    Reads an Excel file in Dropbox into a pandas DataFrame.
+    Parsed sheets are cached by file revision: a metadata call checks whether
+    the file changed, and it is only downloaded and parsed again if it did.
+    """
+    cached = _SPREADSHEET_CACHE.get(dropbox_path)
+    if cached and cached[0] == get_file_rev(dbx, dropbox_path):
+        return cached[1].copy()
+
+    file_content, rev = download_file_with_rev(dbx, dropbox_path)
     #st.write("File downloaded")
     if file_content:
         try:
-            return pd.read_excel(BytesIO(file_content))
+            df = pd.read_excel(BytesIO(file_content))
+            _SPREADSHEET_CACHE[dropbox_path] = (rev, df)
+            return df.copy()
         except Exception as e:
             st.error(f"Error reading Excel file from Dropbox: {e}")
             return pd.DataFrame()
@@ -238,6 +423,94 @@ def create_folder(dbx, folder_path):
         else:
             st.error(f"Dropbox API error during folder creation: {e}")
 
+def create_folders_batch(dbx, folder_paths):
+    """
+    Creates several folders with a single Dropbox call, ignoring ones that already exist.
+    Returns True if every folder exists afterwards.
+    """
+    all_ok = True
+    try:
+        launch = dbx.files_create_folder_batch(list(folder_paths), autorename=False)
+        if launch.is_async_job_id():
+            job_id = launch.get_async_job_id()
+            status = dbx.files_create_folder_batch_check(job_id)
+            while status.is_in_progress():
+                time.sleep(0.5)
+                status = dbx.files_create_folder_batch_check(job_id)
+            if not status.is_complete():
+                st.error(f"Dropbox API error during folder creation: {status}")
+                return False
+            entries = status.get_complete().entries
+        else:
+            entries = launch.get_complete().entries
+
+        for folder_path, entry in zip(folder_paths, entries):
+            if entry.is_failure():
+                error = entry.get_failure()
+                if error.is_path() and error.get_path().is_conflict():
+                    continue # Folder already exists
+                st.error(f"Dropbox API error creating folder {folder_path}: {error}")
+                all_ok = False
+        return all_ok
+    except ApiError as e:
+        st.error(f"Dropbox API error during folder creation: {e}")
+        return False
+
+def get_missing_paths(dbx, dropbox_paths):
+    """
+    Returns the paths that don't exist in Dropbox, checking them concurrently.
+    Only a path/not_found answer counts as missing; a path whose lookup fails
+    for any other reason is logged and treated as present, so it isn't recreated.
+    """
+    if not dropbox_paths:
+        return []
+
+    def _exists(dropbox_path):
+        try:
+            dbx.files_get_metadata(dropbox_path)
+            return True
+        except ApiError as e:
+            if e.error.is_path() and e.error.get_path().is_not_found():
+                return False
+            print(f"Dropbox API error checking {dropbox_path}: {e}")
+            return True
+
+    with ThreadPoolExecutor(max_workers=min(8, len(dropbox_paths))) as executor:
+        exists = list(executor.map(_exists, dropbox_paths))
+    return [path for path, found in zip(dropbox_paths, exists) if not found]
+
+def upload_new_files_batch(dbx, files_by_path):
+    """
+    Uploads several small new files and commits them together with one
+    upload_session_finish_batch call instead of one upload per file. The
+    upload sessions are started concurrently, so the whole batch costs about
+    two round trips.
+    """
+    if not files_by_path:
+        return True
+
+    def _start_session(item):
+        dropbox_path, file_content = item
+        session = dbx.files_upload_session_start(file_content, close=True)
+        cursor = dropbox.files.UploadSessionCursor(session_id=session.session_id, offset=len(file_content))
+        commit = dropbox.files.CommitInfo(path=dropbox_path, mode=dropbox.files.WriteMode.add)
+        return dropbox.files.UploadSessionFinishArg(cursor=cursor, commit=commit)
+
+    try:
+        with ThreadPoolExecutor(max_workers=min(8, len(files_by_path))) as executor:
+            finish_args = list(executor.map(_start_session, files_by_path.items()))
+
+        result = dbx.files_upload_session_finish_batch_v2(finish_args)
+        all_ok = True
+        for finish_arg, entry in zip(finish_args, result.entries):
+            if entry.is_failure():
+                st.error(f"Dropbox API error uploading {finish_arg.commit.path}: {entry.get_failure()}")
+                all_ok = False
+        return all_ok
+    except ApiError as e:
+        st.error(f"Dropbox API error during batch upload: {e}")
+        return False
+
 def list_files(dbx, folder_path):
     """Lists all files in a specific folder in Dropbox."""
     try:
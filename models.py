@@ -1,5 +1,5 @@
 # models.py
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from typing import List, Optional
 
 class AuditParaSchema(BaseModel):
@@ -25,6 +25,20 @@ class ParsedDARReport(BaseModel):
     audit_paras: List[AuditParaSchema] = []
     parsing_errors: Optional[str] = Field(None, description="Any errors or notes from the parsing process.")
 
+    @classmethod
+    def from_error(cls, message: str) -> "ParsedDARReport":
+        """Returns an empty report carrying an error, copied from a prebuilt instance instead of re-validated."""
+        return _EMPTY_PARSED_REPORT.model_copy(update={"parsing_errors": message}, deep=True)
+
+_EMPTY_PARSED_REPORT = ParsedDARReport()
+
+def summarize_validation_error(error: ValidationError) -> str:
+    """Condenses a ValidationError into 'field.path: message' entries for parsing_errors."""
+    return "; ".join(
+        f"{'.'.join(str(part) for part in err['loc']) or 'report'}: {err['msg']}"
+        for err in error.errors(include_url=False, include_input=False)
+    )
+
 # For the final flattened table output
 class FlattenedAuditData(BaseModel):
     audit_group_number: Optional[int] = None
@@ -2,30 +2,39 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
-from dropbox_utils import read_from_spreadsheet
+from dropbox_utils import read_from_spreadsheet, read_login_log_records
 from config import LOG_FILE_PATH
 
 # Expected column names in the log sheet.
 LOG_SHEET_COLUMNS = ['Timestamp', 'Username', 'Role']
 
 @st.cache_data(ttl=300)
-def get_log_data(_dbx):
+def get_log_data(_dbx, days=None):
     """
-    Reads and caches data from the log spreadsheet in Dropbox.
+    Reads and caches login records from Dropbox: the daily JSONL logs
+    (only the last `days` days, if given) plus any history still held in
+    the legacy log spreadsheet.
     The _dbx argument is prefixed with an underscore to indicate it's
     used for caching purposes and shouldn't be hashed.
     """
     if not _dbx:
         return pd.DataFrame(columns=LOG_SHEET_COLUMNS)
-    
-    # Read the log file directly from the defined path in Dropbox
-    df = read_from_spreadsheet(_dbx, LOG_FILE_PATH)
-    
-    # Return an empty DataFrame with correct columns if the sheet is empty or has a different structure
-    if df.empty or list(df.columns) != LOG_SHEET_COLUMNS:
-         return pd.DataFrame(columns=LOG_SHEET_COLUMNS)
-         
-    return df
+
+    frames = []
+
+    # Older logins were written to the spreadsheet before the JSONL logs existed
+    legacy_df = read_from_spreadsheet(_dbx, LOG_FILE_PATH)
+    if not legacy_df.empty and list(legacy_df.columns) == LOG_SHEET_COLUMNS:
+        frames.append(legacy_df)
+
+    since = (datetime.now() - timedelta(days=days)).date() if days else None
+    records = read_login_log_records(_dbx, since=since)
+    if records:
+        frames.append(pd.DataFrame(records, columns=LOG_SHEET_COLUMNS))
+
+    if not frames:
+        return pd.DataFrame(columns=LOG_SHEET_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
 
 def generate_login_report(df_logs, days):
     """
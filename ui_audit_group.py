@@ -3,30 +3,30 @@ import streamlit as st
 import pandas as pd
 import datetime
 import math
-from io import BytesIO
 import time
 import json
 from streamlit_option_menu import option_menu
-import html
 
 # --- Custom Module Imports for Dropbox Version ---
 from dropbox_utils import (
     read_from_spreadsheet,
     update_spreadsheet_from_df,
-    upload_file,upload_pdf_file,
+    upload_pdf_file_async,
     get_shareable_link
 )
-from dar_processor import preprocess_pdf_text, get_structured_data_from_llm, get_para_classifications_from_llm
+from dar_processor import (
+    preprocess_pdf_text, get_structured_data_from_llm, get_para_classifications_from_llm,
+    load_cached_dar_report, save_dar_report_to_cache
+)
 from validation_utils import validate_data_for_sheet, VALID_CATEGORIES, VALID_PARA_STATUSES
 from config import (
-    USER_CREDENTIALS,
+    verify_password,
     MCM_PERIODS_INFO_PATH,
     MCM_DATA_PATH,
     DAR_PDFS_PATH,
     TAXPAYER_CLASSIFICATION_OPTIONS,
     GST_RISK_PARAMETERS
 )
-from models import ParsedDARReport
 
 # --- Constants and Configuration ---
 SHEET_DATA_COLUMNS_ORDER = [
@@ -105,8 +105,7 @@ def audit_group_dashboard(dbx):
         'ag_submission_in_progress': False  # ADD THIS LINE
     }
     for key, value in default_ag_states.items():
-        if key not in st.session_state:
-            st.session_state[key] = value
+        st.session_state.setdefault(key, value)
 
     with st.sidebar:
         try: st.image("logo.png", width=80)
@@ -173,26 +172,33 @@ def upload_dar_tab(dbx, active_periods, api_key):
         reset_ag_states(clear_file=False)
         st.rerun()
 
+    keep_layout = st.checkbox("Keep table layout (slower; try this if amounts come out jumbled)", key='ag_keep_layout')
     if st.session_state.ag_current_uploaded_file_obj and st.button("Extract Data", use_container_width=True):
         progress_bar = st.progress(0, text="Starting process...")
         pdf_bytes = st.session_state.ag_current_uploaded_file_obj.getvalue()
         st.session_state.ag_pdf_bytes = pdf_bytes
-        progress_bar.progress(33, text="▶️ Stage 1/3: Pre-processing PDF content...")
-        preprocessed_text = preprocess_pdf_text(BytesIO(pdf_bytes))
-        if preprocessed_text.startswith("Error"):
-            st.error(f"❌ Failed: {preprocessed_text}")
-            st.stop()
-        
-        #progress_bar.progress(66, text="▶️ Stage 2/3: Extracting with AI...")
-        progress_bar.progress(66)
-        st.markdown(
-            "<div style='padding: 10px; background-color: #e3f2fd; border-left: 4px solid #2196f3; margin: 10px 0;'>"
-            "<strong style='color: #1976d2; font-size: 16px;'>▶️ Stage 2/3: Extracting with AI</strong><br>"
-            "<span style='color: #424242;'>(It may take 2 minutes..Pls wait)</span>"
-            "</div>", 
-            unsafe_allow_html=True
-        )
-        parsed_data = get_structured_data_from_llm(preprocessed_text)
+        parsed_data = load_cached_dar_report(pdf_bytes, keep_layout)
+        if parsed_data is not None:
+            st.info("♻️ This DAR was extracted before; reusing the saved result.")
+        else:
+            progress_bar.progress(33, text="▶️ Stage 1/3: Pre-processing PDF content...")
+            # Pass the bytes straight through; wrapping them in BytesIO only makes preprocess copy them again
+            preprocessed_text = preprocess_pdf_text(pdf_bytes, use_layout=keep_layout)
+            if preprocessed_text.startswith("Error"):
+                st.error(f"❌ Failed: {preprocessed_text}")
+                st.stop()
+            
+            #progress_bar.progress(66, text="▶️ Stage 2/3: Extracting with AI...")
+            progress_bar.progress(66)
+            st.markdown(
+                "<div style='padding: 10px; background-color: #e3f2fd; border-left: 4px solid #2196f3; margin: 10px 0;'>"
+                "<strong style='color: #1976d2; font-size: 16px;'>▶️ Stage 2/3: Extracting with AI</strong><br>"
+                "<span style='color: #424242;'>(It may take 2 minutes..Pls wait)</span>"
+                "</div>", 
+                unsafe_allow_html=True
+            )
+            parsed_data = get_structured_data_from_llm(preprocessed_text)
+            save_dar_report_to_cache(pdf_bytes, parsed_data, keep_layout)
         if parsed_data.parsing_errors:
             st.warning(f"AI Parsing Issues: {parsed_data.parsing_errors}")
        
@@ -336,15 +342,7 @@ def upload_dar_tab(dbx, active_periods, api_key):
                     st.session_state.ag_submission_in_progress = False  # Reset on error
                     return
 
-            status_area.info("✅ Step 2/7: No duplicates found. \n\n▶️ Step 3/7: Uploading PDF...")
-            dar_filename = f"AG{st.session_state.audit_group_no}_{st.session_state.ag_current_uploaded_file_name}"
-            pdf_path = f"{DAR_PDFS_PATH}/{dar_filename}"
-            if not upload_pdf_file(dbx, st.session_state.ag_pdf_bytes, pdf_path):
-                status_area.error("❌ Submission Failed: Could not upload PDF.")
-                st.session_state.ag_submission_in_progress = False  # Reset on error
-                return
-            
-            status_area.info("✅ Step 3/7: PDF uploaded. \n\n▶️ Step 4/7: Classifying paras with AI...")
+            status_area.info("✅ Step 2/7: No duplicates found. \n\n▶️ Step 3/7: Classifying paras with AI...")
             headings = df_to_submit[df_to_submit['audit_para_number'].notna()]['audit_para_heading'].tolist()
             if headings:
                 classifications, class_error = get_para_classifications_from_llm(headings)
@@ -357,10 +355,22 @@ def upload_dar_tab(dbx, active_periods, api_key):
                 para_rows = df_to_submit['audit_para_number'].notna()
                 df_to_submit.loc[para_rows, 'para_classification_code'] = classifications[:len(df_to_submit[para_rows])]
 
-            status_area.info("✅ Step 4/7: Classification complete. \n\n▶️ Step 5/7: Reading master data (final check)...")
+            # Upload only once classification has gone through, so an aborted submission
+            # leaves no PDF behind; the master data read overlaps with the upload instead
+            dar_filename = f"AG{st.session_state.audit_group_no}_{st.session_state.ag_current_uploaded_file_name}"
+            pdf_path = f"{DAR_PDFS_PATH}/{dar_filename}"
+            upload_future = upload_pdf_file_async(dbx, st.session_state.ag_pdf_bytes, pdf_path)
+
+            status_area.info("✅ Step 3/7: Classification complete. \n\n▶️ Step 4/7: Uploading PDF... \n\n▶️ Step 5/7: Reading master data (final check)...")
             master_df = read_from_spreadsheet(dbx, MCM_DATA_PATH)
-            
-            status_area.info("✅ Step 5/7: Master data read. \n\n▶️ Step 6/7: Preparing final data...")
+
+            upload_error = upload_future.result()
+            if upload_error:
+                status_area.error(f"❌ Submission Failed: Could not upload PDF. {upload_error}")
+                st.session_state.ag_submission_in_progress = False  # Reset on error
+                return
+
+            status_area.info("✅ Step 4/7: PDF uploaded. \n\n✅ Step 5/7: Master data read. \n\n▶️ Step 6/7: Preparing final data...")
             df_to_submit['mcm_period'] = selected_period_str
             df_to_submit['dar_pdf_path'] = pdf_path
             df_to_submit['record_created_date'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -668,7 +678,7 @@ def delete_entries_tab(dbx):
             with st.form(key=f"delete_form_{index_to_delete}"):
                 password = st.text_input("Enter your password to confirm:", type="password")
                 if st.form_submit_button("Yes, Delete This Entry", type="primary"):
-                    if password == USER_CREDENTIALS.get(st.session_state.username):
+                    if verify_password(st.session_state.username, password):
                         with st.spinner("Deleting entry..."):
                             df_after_delete = master_df.drop(index=index_to_delete).drop(columns=['original_index'])
                             if update_spreadsheet_from_df(dbx, df_after_delete, MCM_DATA_PATH):
@@ -2,23 +2,26 @@
 import streamlit as st
 import os
 import base64
-from config import USER_CREDENTIALS, USER_ROLES, AUDIT_GROUP_NUMBERS
+from config import authenticate
+from dropbox_utils import get_dropbox_client, log_activity_async
+
+@st.cache_data
+def get_image_base64_str(img_path):
+    """Reads an image once and returns it base64-encoded for inline HTML."""
+    try:
+        with open(img_path, "rb") as img_file:
+            return base64.b64encode(img_file.read()).decode('utf-8')
+    except FileNotFoundError:
+        st.error(f"Logo image not found at path: {img_path}. Ensure 'logo.png' is present.")
+        return None
+    except Exception as e:
+        st.error(f"Error reading image file {img_path}: {e}")
+        return None
 
 def login_page():
     st.markdown("<div class='page-main-title'>e-MCM App</div>", unsafe_allow_html=True)
     st.markdown("<h2 class='page-app-subtitle'>GST Audit 1 Commissionerate</h2>", unsafe_allow_html=True)
 
-    def get_image_base64_str(img_path):
-        try:
-            with open(img_path, "rb") as img_file:
-                return base64.b64encode(img_file.read()).decode('utf-8')
-        except FileNotFoundError:
-            st.error(f"Logo image not found at path: {img_path}. Ensure 'logo.png' is present.")
-            return None
-        except Exception as e:
-            st.error(f"Error reading image file {img_path}: {e}")
-            return None
-
     image_path = "logo.png"
     base64_image = get_image_base64_str(image_path)
     if base64_image:
@@ -37,17 +40,25 @@ def login_page():
     </div>
     """, unsafe_allow_html=True)
 
-    username = st.text_input("Username", key="login_username_styled", placeholder="Enter your username")
-    password = st.text_input("Password", type="password", key="login_password_styled",
-                             placeholder="Enter your password")
+    # Inputs are batched in a form so typing doesn't rerun the page; Enter submits.
+    with st.form("login_form", clear_on_submit=False, enter_to_submit=True):
+        username = st.text_input("Username", key="login_username_styled", placeholder="Enter your username")
+        password = st.text_input("Password", type="password", key="login_password_styled",
+                                 placeholder="Enter your password")
+        login_clicked = st.form_submit_button("Login", key="login_button_styled", use_container_width=True)
 
-    if st.button("Login", key="login_button_styled", use_container_width=True):
-        if username in USER_CREDENTIALS and USER_CREDENTIALS[username] == password:
+    if login_clicked:
+        user_record = authenticate(username, password)
+        if user_record:
+            role, audit_group_no = user_record
             st.session_state.logged_in = True
             st.session_state.username = username
-            st.session_state.role = USER_ROLES[username]
-            if st.session_state.role == "AuditGroup":
-                st.session_state.audit_group_no = AUDIT_GROUP_NUMBERS[username]
+            st.session_state.role = role
+            if role == "AuditGroup":
+                st.session_state.audit_group_no = audit_group_no
+            dbx = get_dropbox_client()
+            if dbx:
+                log_activity_async(dbx, username, role)
             st.success(f"Logged in as {username} ({st.session_state.role})")
             st.rerun()
         else:
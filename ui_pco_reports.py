@@ -31,7 +31,7 @@ def pco_reports_dashboard(dbx):
 
         with st.spinner("Fetching and processing log data from Dropbox..."):
             # Use the data fetching function adapted for Dropbox
-            log_df = get_log_data(dbx)
+            log_df = get_log_data(dbx, days_option)
             
             if log_df.empty:
                 st.info("No log data has been recorded yet.")
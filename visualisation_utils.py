@@ -5,7 +5,7 @@ import plotly.graph_objects as go
 import numpy as np
 import json
 from dropbox_utils import read_from_spreadsheet
-from config import MCM_DATA_PATH
+from config import MCM_DATA_PATH, GST_RISK_PARAMETERS
 from plotly.subplots import make_subplots
 import streamlit as st
 def wrap_text(text, max_length=15):
@@ -700,42 +700,6 @@ def get_visualization_data(dbx, selected_period):
                 pass  # Skip treemap if it fails
         
         # CHARTS 15-18: Risk Parameter Analysis (COMPREHENSIVE REPLICA)
-        GST_RISK_PARAMETERS = {
-            "P01": "Sale turnover (GSTR-3B) is less than the purchase turnover", 
-            "P02": "IGST paid on import is more than the ITC availed in GSTR-3B",
-            "P03": "High ratio of nil-rated/exempt supplies to total turnover",
-            "P04": "High ratio of zero-rated supplies to total turnover", 
-            "P05": "High ratio of inward supplies liable to reverse charge to total turnover",
-            "P06": "Mismatch between RCM liability declared and ITC claimed on RCM",
-            "P07": "High ratio of tax paid through ITC to total tax payable",
-            "P08": "Low ratio of tax payment in cash to total tax liability",
-            "P09": "Decline in average monthly taxable turnover in GSTR-3B",
-            "P10": "High ratio of non-GST supplies to total turnover", 
-            "P11": "Taxpayer has filed more than six GST returns late",
-            "P12": "Taxpayer has not filed three consecutive GSTR-3B returns",
-            "P13": "Taxpayer has both SEZ and non-SEZ registrations with the same PAN in the same state",
-            "P14": "Positive difference between ITC availed in GSTR-3B and ITC available in GSTR-2A",
-            "P15": "Positive difference between ITC on import of goods (GSTR-3B) and IGST paid at Customs",
-            "P16": "Low ratio of tax paid under RCM compared to ITC claimed on RCM",
-            "P17": "High ratio of ISD credit to total ITC availed",
-            "P18": "Low ratio of ITC reversed to total ITC availed",
-            "P19": "Mismatch between the proportion of exempt supplies and the proportion of ITC reversed",
-            "P20": "Mismatch between the taxable value of exports in GSTR-1 and the IGST value in shipping bills (Customs data)",
-            "P21": "High ratio of zero-rated supply to SEZ to total GST turnover",
-            "P22": "High ratio of deemed exports to total GST turnover", 
-            "P23": "High ratio of zero-rated supply (other than exports) to total supplies",
-            "P24": "Risk associated with other linked GSTINs of the same PAN",
-            "P25": "High amount of IGST Refund claimed (for Risky Exporters)",
-            "P26": "High amount of LUT Export Refund claimed (for Risky Exporters)",
-            "P27": "High amount of Refund claimed due to inverted duty structure (for Risky Exporters)",
-            "P28": "Taxpayer is flagged in Red Flag Reports of DGARM",
-            "P29": "High ratio of taxable turnover as per ITC-04 vs. total turnover in GSTR-3B", 
-            "P30": "Taxpayer was selected for audit on risk criteria last year but was not audited",
-            "P31": "High ratio of Credit Notes to total taxable turnover value",
-            "P32": "High ratio of Debit Notes to total taxable turnover value",
-            "P33": "Substantial difference between turnover in GSTR-3B and turnover in Income Tax Return (ITR)",
-            "P34": "Negligible income tax payment despite substantial turnover in GSTR-3B"
-        }
         risk_summary = []
         gstins_with_risk_data = 0
         paras_linked_to_risks = 0